@@ -0,0 +1,15 @@
+# Gunicorn settings for production (picked up automatically from the backend directory)
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Download progress, auth tokens and pending R2 uploads live in process memory,
+# so keep a single worker and get concurrency from threads instead.
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+
+# Video streams can run for a while; don't kill a worker mid-transfer
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
@@ -1,5 +1,9 @@
 import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
 from botocore.exceptions import ClientError
 from pathlib import Path
@@ -12,21 +16,84 @@ R2_SECRET_ACCESS_KEY = os.environ.get('R2_SECRET_ACCESS_KEY')
 R2_BUCKET_NAME = os.environ.get('R2_BUCKET_NAME', 'fwp-videos')
 R2_ENDPOINT_URL = os.environ.get('R2_ENDPOINT_URL') or f'https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com'
 
+# One client per process: its urllib3 pool keeps TLS connections to R2 alive
+# across requests, sized so concurrent uploads/HEADs don't queue for a socket
+R2_CLIENT_CONFIG = Config(
+    signature_version='s3v4',
+    tcp_keepalive=True,
+    max_pool_connections=int(os.environ.get('R2_MAX_POOL_CONNECTIONS', 64)),
+    retries={'max_attempts': 5, 'mode': 'adaptive'},
+    connect_timeout=5,
+    read_timeout=60
+)
+
+# Multipart settings for video uploads: 16 MiB parts sent 10 at a time
+R2_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=10,
+    use_threads=True,
+    max_io_queue=100
+)
+
+# HEAD results are cached per object key; misses expire sooner so a video
+# uploaded by another worker shows up quickly
+R2_HEAD_CACHE_TTL = int(os.environ.get('R2_HEAD_CACHE_TTL', 300))
+R2_HEAD_MISS_TTL = min(R2_HEAD_CACHE_TTL, 30)
+_head_cache = {}  # object_key -> (expires_at, {'size', 'etag', 'last_modified'} or None if missing)
+
+# Background uploads so a finished download doesn't hold its worker thread
+R2_UPLOAD_WORKERS = int(os.environ.get('R2_UPLOAD_WORKERS', 4))
+_upload_pool = None
+
+# Content types by file extension; anything unlisted is uploaded as video/mp4
+_CONTENT_TYPES = {
+    '.mp4': 'video/mp4',
+    '.m4a': 'audio/mp4',
+    '.webm': 'video/webm',
+    '.mkv': 'video/x-matroska',
+}
+
 # Check if R2 is configured
 R2_ENABLED = all([R2_ACCOUNT_ID, R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY])
 
-# Initialize S3 client for R2
+
+@lru_cache(maxsize=1)
+def _get_session() -> boto3.session.Session:
+    """Process-wide boto3 session, so credential/config resolution happens once"""
+    return boto3.session.Session(
+        aws_access_key_id=R2_ACCESS_KEY_ID,
+        aws_secret_access_key=R2_SECRET_ACCESS_KEY,
+        region_name='auto',  # R2 uses 'auto' for region
+    )
+
+
+@lru_cache(maxsize=1)
+def _get_client():
+    """Shared R2 client - always go through this rather than building clients per call"""
+    return _get_session().client('s3', endpoint_url=R2_ENDPOINT_URL, config=R2_CLIENT_CONFIG)
+
+
+def get_r2_client():
+    """The current shared R2 client, or None when R2 isn't configured (tracks reset_r2_client)"""
+    return _get_client() if R2_ENABLED else None
+
+
+def reset_r2_client():
+    """Drop the cached session/client (e.g. after rotating credentials) and build a new one"""
+    global s3_client
+    _get_client.cache_clear()
+    _get_session.cache_clear()
+    s3_client = _get_client() if R2_ENABLED else None
+    return s3_client
+
+
+# Initialize S3 client for R2. s3_client is kept for older callers; the helpers
+# below call _get_client() so reset_r2_client() takes effect everywhere.
 s3_client = None
 if R2_ENABLED:
     try:
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=R2_ENDPOINT_URL,
-            aws_access_key_id=R2_ACCESS_KEY_ID,
-            aws_secret_access_key=R2_SECRET_ACCESS_KEY,
-            region_name='auto',  # R2 uses 'auto' for region
-            config=Config(signature_version='s3v4')
-        )
+        s3_client = _get_client()
         print(f"✓ R2 storage initialized: bucket={R2_BUCKET_NAME}, endpoint={R2_ENDPOINT_URL}")
     except Exception as e:
         print(f"✗ Failed to initialize R2 client: {str(e)}")
@@ -38,23 +105,21 @@ else:
 
 def upload_to_r2(local_file_path: Path, object_key: str) -> bool:
     """Upload a file to R2 bucket"""
-    if not R2_ENABLED or not s3_client:
+    if not R2_ENABLED:
         return False
     
     try:
         # Determine content type based on file extension
-        content_type = 'video/mp4'
-        if object_key.endswith('.m4a'):
-            content_type = 'audio/mp4'
-        elif object_key.endswith('.webm'):
-            content_type = 'video/webm'
+        content_type = _CONTENT_TYPES.get(os.path.splitext(object_key)[1].lower(), 'video/mp4')
         
-        s3_client.upload_file(
+        _get_client().upload_file(
             str(local_file_path),
             R2_BUCKET_NAME,
             object_key,
-            ExtraArgs={'ContentType': content_type}
+            ExtraArgs={'ContentType': content_type},
+            Config=R2_TRANSFER_CONFIG
         )
+        _head_cache.pop(object_key, None)
         print(f"✓ Uploaded {object_key} to R2")
         return True
     except Exception as e:
@@ -62,13 +127,82 @@ def upload_to_r2(local_file_path: Path, object_key: str) -> bool:
         return False
 
 
+def upload_to_r2_async(local_file_path: Path, object_key: str) -> Optional[Future]:
+    """Queue an upload to R2 on the background pool (Future resolves to upload_to_r2's result)"""
+    global _upload_pool
+    if not R2_ENABLED:
+        return None
+    
+    if _upload_pool is None:
+        _upload_pool = ThreadPoolExecutor(max_workers=R2_UPLOAD_WORKERS)
+    return _upload_pool.submit(upload_to_r2, local_file_path, object_key)
+
+
+def _download_range(object_key: str, local_path: Path, start: int, end: int):
+    """Fetch bytes start..end (inclusive) of an object into the same offset of local_path"""
+    response = _get_client().get_object(Bucket=R2_BUCKET_NAME, Key=object_key, Range=f'bytes={start}-{end}')
+    expected = end - start + 1
+    written = 0
+    with open(local_path, 'r+b') as f:
+        f.seek(start)
+        for chunk in response['Body'].iter_chunks(1 << 20):
+            f.write(chunk)
+            written += len(chunk)
+    # The file is preallocated, so a short body would otherwise leave zeros behind
+    if written != expected:
+        raise IOError(f"Short read for bytes {start}-{end} of {object_key}: got {written} of {expected}")
+
+
+def download_from_r2_concurrent(object_key: str, local_path: Path,
+                                part_size: int = 16 * 1024 * 1024, workers: int = 8) -> bool:
+    """Download an object from R2 using parallel byte-range GETs"""
+    if not R2_ENABLED:
+        return False
+    
+    try:
+        info = _head(object_key)
+        if info is None:
+            print(f"✗ {object_key} not found in R2")
+            return False
+        size = info['size'] or 0
+        
+        if size <= part_size:
+            _get_client().download_file(R2_BUCKET_NAME, object_key, str(local_path), Config=R2_TRANSFER_CONFIG)
+            print(f"✓ Downloaded {object_key} from R2")
+            return True
+        
+        # Preallocate so every worker can write its range in place
+        with open(local_path, 'wb') as f:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(f.fileno(), 0, size)
+            else:
+                f.truncate(size)
+        
+        ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+        with ThreadPoolExecutor(max_workers=min(workers, len(ranges))) as pool:
+            futures = [pool.submit(_download_range, object_key, local_path, start, end) for start, end in ranges]
+            for future in futures:
+                future.result()
+        
+        print(f"✓ Downloaded {object_key} from R2 ({len(ranges)} parts)")
+        return True
+    except Exception as e:
+        print(f"✗ Failed to download {object_key} from R2: {str(e)}")
+        try:
+            Path(local_path).unlink()
+        except OSError:
+            pass
+        return False
+
+
 def delete_from_r2(object_key: str) -> bool:
     """Delete a file from R2 bucket"""
-    if not R2_ENABLED or not s3_client:
+    if not R2_ENABLED:
         return False
     
+    _head_cache.pop(object_key, None)
     try:
-        s3_client.delete_object(Bucket=R2_BUCKET_NAME, Key=object_key)
+        _get_client().delete_object(Bucket=R2_BUCKET_NAME, Key=object_key)
         print(f"✓ Deleted {object_key} from R2")
         return True
     except ClientError as e:
@@ -82,13 +216,43 @@ def delete_from_r2(object_key: str) -> bool:
         return False
 
 
+def delete_many_from_r2(object_keys: list) -> set:
+    """Delete several files from R2 with batched DeleteObjects calls; returns the keys that were deleted"""
+    if not R2_ENABLED or not object_keys:
+        return set()
+    
+    deleted = set()
+    keys = list(dict.fromkeys(object_keys))
+    for i in range(0, len(keys), 1000):  # DeleteObjects accepts at most 1000 keys
+        batch = keys[i:i + 1000]
+        for key in batch:
+            _head_cache.pop(key, None)
+        try:
+            # Quiet mode only reports failures, so everything else in the batch succeeded
+            response = _get_client().delete_objects(
+                Bucket=R2_BUCKET_NAME,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+        except Exception as e:
+            print(f"✗ Failed to delete {len(batch)} file(s) from R2: {str(e)}")
+            continue
+        failed = {err['Key'] for err in response.get('Errors', [])}
+        for err in response.get('Errors', []):
+            print(f"✗ Failed to delete {err['Key']} from R2: {err.get('Message', err.get('Code'))}")
+        deleted.update(key for key in batch if key not in failed)
+    
+    if deleted:
+        print(f"✓ Deleted {len(deleted)} file(s) from R2")
+    return deleted
+
+
 def get_r2_url(object_key: str, expires_in: int = 3600) -> Optional[str]:
     """Generate a presigned URL for R2 object (valid for expires_in seconds)"""
-    if not R2_ENABLED or not s3_client:
+    if not R2_ENABLED:
         return None
     
     try:
-        url = s3_client.generate_presigned_url(
+        url = _get_client().generate_presigned_url(
             'get_object',
             Params={'Bucket': R2_BUCKET_NAME, 'Key': object_key},
             ExpiresIn=expires_in
@@ -99,17 +263,38 @@ def get_r2_url(object_key: str, expires_in: int = 3600) -> Optional[str]:
         return None
 
 
+def _head(object_key: str) -> Optional[dict]:
+    """HEAD an object through the TTL cache (size/etag/last_modified dict, or None if it doesn't exist)"""
+    now = time.monotonic()
+    cached = _head_cache.get(object_key)
+    if cached and cached[0] > now:
+        return cached[1]
+    
+    try:
+        response = _get_client().head_object(Bucket=R2_BUCKET_NAME, Key=object_key)
+    except ClientError as e:
+        if e.response['Error']['Code'] != '404':
+            raise
+        _head_cache[object_key] = (now + R2_HEAD_MISS_TTL, None)
+        return None
+    
+    info = {
+        'size': response.get('ContentLength'),
+        'etag': response.get('ETag'),
+        'last_modified': response.get('LastModified'),
+    }
+    _head_cache[object_key] = (now + R2_HEAD_CACHE_TTL, info)
+    return info
+
+
 def file_exists_in_r2(object_key: str) -> bool:
     """Check if a file exists in R2"""
-    if not R2_ENABLED or not s3_client:
+    if not R2_ENABLED:
         return False
     
     try:
-        s3_client.head_object(Bucket=R2_BUCKET_NAME, Key=object_key)
-        return True
+        return _head(object_key) is not None
     except ClientError as e:
-        if e.response['Error']['Code'] == '404':
-            return False
         print(f"✗ Error checking R2 for {object_key}: {str(e)}")
         return False
     except Exception as e:
@@ -119,18 +304,28 @@ def file_exists_in_r2(object_key: str) -> bool:
 
 def get_file_size_from_r2(object_key: str) -> Optional[int]:
     """Get file size from R2"""
-    if not R2_ENABLED or not s3_client:
+    if not R2_ENABLED:
         return None
     
     try:
-        response = s3_client.head_object(Bucket=R2_BUCKET_NAME, Key=object_key)
-        return response.get('ContentLength')
+        info = _head(object_key)
+        return info['size'] if info else None
     except ClientError as e:
-        if e.response['Error']['Code'] == '404':
-            return None
         print(f"✗ Error getting file size from R2 for {object_key}: {str(e)}")
         return None
     except Exception as e:
         print(f"✗ Error getting file size from R2 for {object_key}: {str(e)}")
         return None
 
+
+
+def get_r2_object_info(object_key: str) -> Optional[dict]:
+    """Get cached HEAD info (size, etag, last_modified) for an R2 object, or None if missing"""
+    if not R2_ENABLED:
+        return None
+    
+    try:
+        return _head(object_key)
+    except Exception as e:
+        print(f"✗ Error checking R2 for {object_key}: {str(e)}")
+        return None
@@ -3,31 +3,56 @@ Fireworks Planner Backend
 Handles YouTube video downloads via yt-dlp and serves video files
 """
 
+import atexit
+import base64
+import hashlib
+import mimetypes
 import os
-import json
+import random
+import secrets
+import shutil
+import string
 import subprocess
 import threading
+import time
+import traceback
 import uuid
+from collections import deque
+from importlib import metadata as importlib_metadata
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from functools import wraps
+from typing import Optional
 import requests
 import re
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
-from urllib.parse import urlparse
+from urllib.parse import quote, urlparse
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, send_from_directory, session, redirect, url_for, Response
+from flask import Flask, request, jsonify, send_from_directory, session, redirect, url_for, Response, g
 from flask_cors import CORS
+from werkzeug.http import http_date
+from werkzeug.middleware.proxy_fix import ProxyFix
 from authlib.integrations.flask_client import OAuth
 from database import (
-    init_db, create_user, verify_user, get_user_by_id, get_user_by_oauth, get_db,
-    save_show, get_user_shows, delete_show,
-    save_library_metadata, get_user_library, delete_library_item,
-    get_video_by_youtube_url, get_video_by_filename, create_video,
-    add_video_to_library, remove_video_from_library,
-    get_video_reference_count, cleanup_orphaned_videos
+    init_db, create_user, verify_user, get_user_by_id, get_user_by_oauth, get_user_oauth_id,
+    db_session, close_request_db, release_request_db, get_user_youtube_cookies_file, open_private_file,
+    library_has_video_with, library_has_video, add_video_to_library_with,
+    get_video_by_filename_with, remove_video_from_library_with,
+    count_video_refs_with, video_is_referenced_with,
+    save_show, save_shows_bulk, get_user_shows, delete_show,
+    save_library_metadata, save_library_metadata_bulk, get_user_library, delete_library_item,
+    get_video_by_youtube_url, get_video_by_filename, create_video, get_user_videos, get_all_video_filenames,
+    register_and_link_video, set_user_youtube_cookies,
+    add_video_to_library, delete_video_record, cleanup_orphaned_videos
 )
 from r2_storage import (
-    upload_to_r2, delete_from_r2, get_r2_url, file_exists_in_r2,
-    get_file_size_from_r2, R2_ENABLED
+    upload_to_r2, upload_to_r2_async, delete_from_r2, delete_many_from_r2,
+    file_exists_in_r2, get_r2_object_info,
+    get_file_size_from_r2, get_r2_client, R2_BUCKET_NAME, R2_ENABLED
 )
+from user_cache import init_user_cache, get_cached_user, user_has_youtube_cookies, invalidate_user
 
 # Load environment variables from .env file
 load_dotenv()
@@ -35,6 +60,32 @@ load_dotenv()
 app = Flask(__name__, static_folder='../frontend', static_url_path='')
 # Use environment variable for secret key in production, generate random one for dev
 app.secret_key = os.environ.get('SECRET_KEY') or ('dev-secret-key-' + str(uuid.uuid4()))
+# Return the request's pooled database connection once the request is done
+app.teardown_appcontext(close_request_db)
+# Behind Render's proxy, take the client address from X-Forwarded-For (rate limits key on it)
+PROXY_FIX_HOPS = int(os.environ.get('PROXY_FIX_HOPS', '1' if 'RENDER' in os.environ else '0'))
+if PROXY_FIX_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_FIX_HOPS, x_proto=PROXY_FIX_HOPS)
+
+# Encode jsonify() responses with orjson when it's installed (Flask 2.2+ JSON providers)
+try:
+    import orjson
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    class ORJSONProvider(DefaultJSONProvider):
+        """JSON provider backed by orjson; datetimes still go through Flask's default (HTTP date format)"""
+        _options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=self.default, option=self._options).decode()
+        
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+    
+    app.json = ORJSONProvider(app)
 
 # CORS configuration - allow localhost for local client
 # In production (Render), allow all origins. For local client, explicitly allow localhost.
@@ -46,6 +97,41 @@ else:
     # Development/local: allow localhost origins
     CORS(app, supports_credentials=True, origins=cors_origins)
 
+# Server-side sessions in Redis when REDIS_URL is set: the cookie only carries a signed
+# session id, and unmodified sessions aren't re-serialized on every response.
+# Without it, Flask's signed-cookie sessions are used as before.
+REDIS_URL = os.environ.get('REDIS_URL')
+redis_client = None
+if REDIS_URL:
+    try:
+        import redis
+        from flask_session import Session
+        redis_client = redis.Redis.from_url(REDIS_URL)
+        app.config.update(
+            SESSION_TYPE='redis',
+            SESSION_REDIS=redis_client,
+            SESSION_USE_SIGNER=True,
+            SESSION_PERMANENT=False,
+        )
+        Session(app)
+        print("✓ Using Redis-backed sessions")
+    except ImportError:
+        redis_client = None
+        print("⚠ REDIS_URL is set but flask-session/redis are not installed - using cookie sessions")
+init_user_cache(redis_client)
+
+# Shared HTTP session for outbound calls (Google, Bright Data, remote server) so
+# repeated requests to the same host reuse pooled keep-alive connections.
+# Retry only applies to idempotent methods - POST uploads are never replayed.
+http_session = requests.Session()
+_http_adapter = HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=50,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+)
+http_session.mount('http://', _http_adapter)
+http_session.mount('https://', _http_adapter)
+
 # Initialize OAuth
 oauth = OAuth(app)
 
@@ -71,6 +157,12 @@ if GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET:
             'scope': 'openid email profile'
         }
     )
+    # Fetch the discovery document (endpoints + jwks_uri) now rather than on the
+    # first login; Authlib caches it on the client afterwards
+    try:
+        google.load_server_metadata()
+    except Exception as e:
+        print(f"⚠ Could not load Google OpenID configuration at startup: {e}")
 else:
     google = None
     print("⚠️  Google OAuth not configured. Set GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET environment variables.")
@@ -79,6 +171,85 @@ else:
 VIDEOS_DIR = Path(__file__).parent / "videos"
 VIDEOS_DIR.mkdir(exist_ok=True)
 
+# When running behind nginx, set this to an internal location aliased to VIDEOS_DIR
+# (e.g. /internal_videos/) so nginx serves local files with sendfile instead of Python
+VIDEOS_ACCEL_REDIRECT_PREFIX = os.environ.get('VIDEOS_ACCEL_REDIRECT_PREFIX', '').strip()
+# Same idea for Apache mod_xsendfile / lighttpd / uWSGI: send X-Sendfile with the absolute path
+VIDEOS_X_SENDFILE = os.environ.get('VIDEOS_X_SENDFILE', '').lower() == 'true'
+# Read size when proxying video bodies from R2
+VIDEO_STREAM_CHUNK_SIZE = 1024 * 1024
+# Downloads are saved as <random video_id>.mp4 and never rewritten, so browsers can keep
+# them for a year. Other names (uploads keep the client's filename and can overwrite an
+# existing file) must be revalidated against the ETag on every use.
+VIDEO_CACHE_CONTROL = 'public, max-age=31536000'
+VIDEO_REVALIDATE_CACHE_CONTROL = 'no-cache'
+_DOWNLOAD_FILENAME_RE = re.compile(r'^[0-9a-f]{8}\.mp4$')
+
+
+def video_cache_control(filename):
+    """Cache-Control for a served video: long-lived only for download-named files"""
+    if _DOWNLOAD_FILENAME_RE.match(filename):
+        return VIDEO_CACHE_CONTROL
+    return VIDEO_REVALIDATE_CACHE_CONTROL
+
+# Cached listing of VIDEOS_DIR: (directory mtime_ns, {filename: size})
+_local_video_index = (None, {})
+
+
+def get_local_video_sizes():
+    """Sizes of the files in VIDEOS_DIR, rescanned only when the directory changes"""
+    global _local_video_index
+    mtime_ns = os.stat(VIDEOS_DIR).st_mtime_ns
+    cached_mtime, sizes = _local_video_index
+    if mtime_ns != cached_mtime:
+        sizes = {}
+        with os.scandir(VIDEOS_DIR) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    sizes[entry.name] = entry.stat().st_size
+        _local_video_index = (mtime_ns, sizes)
+    return sizes
+
+
+def invalidate_local_video_index():
+    """Force the next get_local_video_sizes() call to rescan VIDEOS_DIR"""
+    global _local_video_index
+    _local_video_index = (None, {})
+
+
+# Registered videos whose file is neither on local disk nor in R2, refreshed by a
+# background sweep so list_videos doesn't have to check every file on every request
+VIDEO_SWEEP_INTERVAL = 300
+_missing_video_files = frozenset()
+_video_sweep_thread = None
+_video_sweep_lock = threading.Lock()
+
+
+def _sweep_video_files():
+    global _missing_video_files
+    while True:
+        try:
+            local_sizes = get_local_video_sizes()
+            missing = set()
+            for filename in get_all_video_filenames():
+                if filename not in local_sizes and not (R2_ENABLED and file_exists_in_r2(filename)):
+                    missing.add(filename)
+            if missing != _missing_video_files:
+                print(f"ℹ Video sweep: {len(missing)} registered video(s) have no file")
+            _missing_video_files = frozenset(missing)
+        except Exception as e:
+            print(f"⚠ Video sweep failed: {e}")
+        time.sleep(VIDEO_SWEEP_INTERVAL)
+
+
+def start_video_file_sweep():
+    """Start the background missing-file sweep (once per process)"""
+    global _video_sweep_thread
+    with _video_sweep_lock:
+        if _video_sweep_thread is None:
+            _video_sweep_thread = threading.Thread(target=_sweep_video_files, name='video-sweep', daemon=True)
+            _video_sweep_thread.start()
+
 # Local downloader mode: Download videos locally but upload to remote server
 # Set LOCAL_DOWNLOADER_MODE=true and REMOTE_SERVER_URL=https://your-server.onrender.com
 LOCAL_DOWNLOADER_MODE = os.environ.get('LOCAL_DOWNLOADER_MODE', '').lower() == 'true'
@@ -94,7 +265,6 @@ COOKIES_FILE = Path(__file__).parent / "youtube_cookies.txt"
 COOKIES_ENV = os.environ.get('YOUTUBE_COOKIES')
 if COOKIES_ENV:
     try:
-        import base64
         cookies_data = base64.b64decode(COOKIES_ENV).decode('utf-8')
         # Verify it's in Netscape format
         if not cookies_data.startswith('# Netscape HTTP Cookie File') and not cookies_data.startswith('# HTTP Cookie File'):
@@ -168,9 +338,6 @@ def add_bright_data_session(proxy_url):
     if not proxy_url or not is_bright_data_proxy(proxy_url):
         return proxy_url
     
-    import random
-    import string
-    
     # Generate random session ID (8 characters)
     session_id = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
     
@@ -217,7 +384,7 @@ def fetch_via_unlocker_api(url, video_id):
         }
         
         print(f"[{video_id}] Trying Bright Data Unlocker API HTTP endpoint...")
-        response = requests.post(api_url, json=payload, headers=headers, timeout=30)
+        response = http_session.post(api_url, json=payload, headers=headers, timeout=30)
         
         if response.status_code == 200:
             print(f"[{video_id}] Unlocker API HTTP endpoint succeeded!")
@@ -275,78 +442,272 @@ else:
 # See: https://github.com/yt-dlp/yt-dlp/wiki/PO-Token-Guide
 # Note: The plugin is auto-discovered by yt-dlp when installed via pip
 # We don't need to import it - yt-dlp will find it automatically
+# importlib.metadata looks up the one distribution instead of scanning them all like pkg_resources
 try:
-    import pkg_resources
-    try:
-        pkg_resources.get_distribution('yt-dlp-get-pot-rustypipe')
-        print("✓ PO Token Provider plugin (yt-dlp-get-pot-rustypipe) is installed")
-    except pkg_resources.DistributionNotFound:
-        # Plugin is in requirements.txt, so it should be installed
-        # yt-dlp will auto-discover it even if we can't verify here
-        print("ℹ PO Token Provider plugin should be available (yt-dlp will auto-discover it)")
-except ImportError:
-    # pkg_resources not available (setuptools not installed)
+    importlib_metadata.distribution('yt-dlp-get-pot-rustypipe')
+    print("✓ PO Token Provider plugin (yt-dlp-get-pot-rustypipe) is installed")
+except importlib_metadata.PackageNotFoundError:
     # Plugin is in requirements.txt, so it should be installed
-    # yt-dlp will auto-discover it
+    # yt-dlp will auto-discover it even if we can't verify here
     print("ℹ PO Token Provider plugin should be available (yt-dlp will auto-discover it)")
 
 # Determine if we're in production (Render.com sets PORT env var)
 IS_PRODUCTION = 'RENDER' in os.environ or 'PORT' in os.environ
 
-# Find FFmpeg location
-FFMPEG_PATH = None
-# Check common WinGet install location
-winget_ffmpeg = Path.home() / "AppData" / "Local" / "Microsoft" / "WinGet" / "Packages"
-for ffmpeg_dir in winget_ffmpeg.glob("yt-dlp.FFmpeg*"):
-    ffmpeg_exe = list(ffmpeg_dir.rglob("ffmpeg.exe"))
-    if ffmpeg_exe:
-        FFMPEG_PATH = str(ffmpeg_exe[0].parent)
-        break
-
-# Also check if ffmpeg is in PATH
-if not FFMPEG_PATH:
+# Find FFmpeg location (None means it's in PATH, no need to specify)
+FFMPEG_PATH = os.environ.get('FFMPEG_PATH')
+# WinGet lookups are remembered here so later starts skip the search
+FFMPEG_PATH_CACHE = Path(__file__).parent / ".ffmpeg_path"
+
+
+def find_winget_ffmpeg():
+    """Find the directory of a WinGet-installed FFmpeg (cached in .ffmpeg_path)"""
     try:
-        result = subprocess.run(["ffmpeg", "-version"], capture_output=True)
-        if result.returncode == 0:
-            FFMPEG_PATH = None  # It's in PATH, no need to specify
-    except FileNotFoundError:
+        cached = FFMPEG_PATH_CACHE.read_text().strip()
+        if cached and (Path(cached) / "ffmpeg.exe").is_file():
+            return cached
+    except OSError:
         pass
+    
+    # Check common WinGet install location; packages unpack ffmpeg.exe at most
+    # two levels down (<package>/<build>/bin), so probe those depths instead of rglob
+    winget_packages = Path.home() / "AppData" / "Local" / "Microsoft" / "WinGet" / "Packages"
+    for ffmpeg_dir in winget_packages.glob("yt-dlp.FFmpeg*"):
+        for pattern in ("ffmpeg.exe", "*/ffmpeg.exe", "*/bin/ffmpeg.exe"):
+            ffmpeg_exe = next(ffmpeg_dir.glob(pattern), None)
+            if ffmpeg_exe:
+                try:
+                    FFMPEG_PATH_CACHE.write_text(str(ffmpeg_exe.parent))
+                except OSError:
+                    pass
+                return str(ffmpeg_exe.parent)
+    return None
+
+
+# The WinGet search is only relevant to local Windows installs, never to the Render deployment
+if not FFMPEG_PATH and os.name == 'nt' and not IS_PRODUCTION and not shutil.which("ffmpeg"):
+    FFMPEG_PATH = find_winget_ffmpeg()
+
+
+@dataclass
+class DownloadState:
+    """Progress of one yt-dlp download (returned as JSON by the status endpoints)"""
+    user_id: Optional[int]
+    youtube_url: str
+    status: str = "starting"
+    progress: float = 0
+    title: str = "Fetching..."
+    filename: Optional[str] = None
+    error: Optional[str] = None
+    queued: bool = False  # waiting for a free download slot (status stays "downloading")
+    
+    def update_progress(self, progress):
+        # yt-dlp redraws progress many times a second - skip sub-1% changes
+        # (either direction: the audio stream restarts from 0 after the video)
+        if abs(progress - self.progress) >= 1 or progress >= 100:
+            self.progress = progress
 
-# Track download progress (per user)
+
+# Track download progress (per user): video_id -> DownloadState. Worker threads only
+# assign attributes on their own entry; adding/removing entries and snapshotting for
+# JSON happen under downloads_lock.
 downloads = {}
+downloads_lock = threading.Lock()
+downloads_by_user = {}  # user_id -> set of video_ids in downloads, kept in step with it
+# Finished downloads are forgotten after this long so the dict doesn't grow forever
+DOWNLOAD_STATE_TTL = 3600
+_download_finished_at = {}  # video_id -> time.monotonic() when run_ytdlp returned
+
+
+def prune_finished_downloads():
+    """Drop download state that finished more than DOWNLOAD_STATE_TTL seconds ago"""
+    cutoff = time.monotonic() - DOWNLOAD_STATE_TTL
+    with downloads_lock:
+        expired = [vid for vid, finished_at in _download_finished_at.items() if finished_at < cutoff]
+        for vid in expired:
+            del _download_finished_at[vid]
+            _unregister_download(vid)
+
+
+def _register_download(video_id, state):
+    """Add or replace a download entry (caller holds downloads_lock)"""
+    downloads[video_id] = state
+    downloads_by_user.setdefault(state.user_id, set()).add(video_id)
+
+
+def _unregister_download(video_id):
+    """Remove a download entry (caller holds downloads_lock)"""
+    state = downloads.pop(video_id, None)
+    if state is None:
+        return
+    user_vids = downloads_by_user.get(state.user_id)
+    if user_vids is not None:
+        user_vids.discard(video_id)
+        if not user_vids:
+            del downloads_by_user[state.user_id]
+
+
+def get_download_snapshot(video_id):
+    """Consistent copy of a download's state as a dict, or None"""
+    with downloads_lock:
+        state = downloads.get(video_id)
+        return asdict(state) if state else None
+
+# Resolve yt-dlp once. Spawning by absolute path with close_fds=False (safe: Python
+# creates fds non-inheritable, PEP 446) lets subprocess use posix_spawn on Linux
+# instead of fork+exec plus a sweep of the fd table.
+YTDLP_BIN = shutil.which("yt-dlp") or "yt-dlp"
+
+# Desktop Chrome user agents, rotated per download to look more like real browsers
+YTDLP_USER_AGENTS = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36 Edg/119.0.0.0",
+)
+# Browser-like request headers shared by every yt-dlp invocation
+YTDLP_STATIC_HEADER_ARGS = (
+    "--referer", "https://www.youtube.com/",
+    "--add-header", "Accept-Language:en-US,en;q=0.9",
+    "--add-header", "Accept:text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "--add-header", "Accept-Encoding:gzip, deflate",
+    "--add-header", "DNT:1",
+    "--add-header", "Connection:keep-alive",
+    "--add-header", "Upgrade-Insecure-Requests:1",
+)
+# PO Token Provider plugin will automatically add PO Tokens when needed
+YTDLP_EXTRACTOR_ARGS = {
+    "mweb": "youtube:player_client=mweb",
+    "android": "youtube:player_client=android",
+}
+
+# yt-dlp output parsing (raw bytes): progress redraws end in \r, other lines in \n
+_YTDLP_LINE_SPLIT_RE = re.compile(rb'[\r\n]')
+# Both are applied to stripped lines; the progress pattern is anchored and used with match()
+_YTDLP_PROGRESS_RE = re.compile(rb'\[download\]\s+(\d+(?:\.\d+)?)%')
+_YTDLP_MERGE_RE = re.compile(rb'^\[Merger\]|Merging')
+# The download command prints the title with this marker just before downloading
+_YTDLP_TITLE_MARKER = b'FWP_TITLE:'
+# YouTube URL validation / video id extraction
+_YOUTUBE_URL_RE = re.compile(r'(?:youtube\.com\/watch\?v=|youtu\.be\/)([a-zA-Z0-9_-]{11})')
+_VIDEO_ID_RES = (
+    re.compile(r'[?&]v=([^&]+)'),
+    re.compile(r'youtu\.be/([^?&]+)'),
+    re.compile(r'^([a-zA-Z0-9_-]{11})$'),
+)
+_HTML_TITLE_RE = re.compile(r'<title>([^<]+)</title>')
+_RANGE_HEADER_RE = re.compile(r'bytes=(\d+)-(\d*)')
+# Progress redraws arrive many times a second - only log when crossing a multiple of this
+PROGRESS_LOG_STEP = 10
+
+# Downloads run on a bounded pool so a burst of requests can't spawn unlimited yt-dlp processes
+MAX_CONCURRENT_DOWNLOADS = int(os.environ.get('MAX_CONCURRENT_DOWNLOADS', 4))
+_download_pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS, thread_name_prefix='ytdl')
+_downloads_in_flight = 0
+_downloads_in_flight_lock = threading.Lock()
+
+
+@atexit.register
+def _shutdown_download_pool():
+    """Drop queued downloads on exit instead of starting them in a dying worker"""
+    try:
+        _download_pool.shutdown(wait=False, cancel_futures=True)
+    except TypeError:  # Python 3.8 has no cancel_futures
+        _download_pool.shutdown(wait=False)
+
+
+def _download_finished(video_id):
+    global _downloads_in_flight
+    with _downloads_in_flight_lock:
+        _downloads_in_flight -= 1
+    with downloads_lock:
+        _download_finished_at[video_id] = time.monotonic()
+
+
+def submit_download(video_id, url):
+    """Queue run_ytdlp on the download pool, marking the download as queued if every slot is busy"""
+    global _downloads_in_flight
+    with _downloads_in_flight_lock:
+        if _downloads_in_flight >= MAX_CONCURRENT_DOWNLOADS:
+            # The frontend only keeps polling "downloading" entries, so flag the wait separately
+            downloads[video_id].status = "downloading"
+            downloads[video_id].queued = True
+            print(f"[{video_id}] All {MAX_CONCURRENT_DOWNLOADS} download slots busy - queued")
+        _downloads_in_flight += 1
+    future = _download_pool.submit(run_ytdlp, video_id, url)
+    future.add_done_callback(lambda _, video_id=video_id: _download_finished(video_id))
+    return future
+
+# In-flight background R2 uploads (video_id -> Future), kept out of `downloads`
+# because that dict is returned as JSON
+r2_uploads = {}
 
 # Initialize database on startup
 init_db()
 
 
 def get_current_user_id():
-    """Get current user ID from session"""
-    return session.get('user_id')
+    """Get current user ID (resolved by auth_required for this request, else the session)"""
+    return g.get('user_id') or session.get('user_id')
 
 
-def require_auth():
-    """Check if user is authenticated - supports both session cookies and auth tokens"""
-    user_id = get_current_user_id()
+def _authenticated_user_id():
+    """User ID from the session cookie or a valid X-Auth-Token header, or None"""
+    user_id = session.get('user_id')
     
     # If no session, try auth token from header
     if not user_id:
         auth_token = request.headers.get('X-Auth-Token')
         if auth_token and hasattr(app, 'auth_tokens') and auth_token in app.auth_tokens:
-            import time
             token_data = app.auth_tokens[auth_token]
             # Check if token expired
             if time.time() < token_data['expires']:
-                # Set user_id in session for this request (temporary)
-                session['user_id'] = token_data['user_id']
                 user_id = token_data['user_id']
             else:
                 # Token expired, remove it
-                del app.auth_tokens[auth_token]
-    
+                app.auth_tokens.pop(auth_token, None)
+    return user_id
+
+
+_UNAUTH_JSON = b'{"error":"Authentication required"}\n'
+
+
+def _unauthorized_response():
+    """401 JSON response for unauthenticated requests"""
+    return Response(_UNAUTH_JSON, status=401, mimetype='application/json')
+
+
+def require_auth():
+    """Check if user is authenticated - supports both session cookies and auth tokens"""
+    user_id = _authenticated_user_id()
     if not user_id:
-        return jsonify({"error": "Authentication required"}), 401
+        return _unauthorized_response()
+    # Token users are remembered on g for this request only, not written to the
+    # session (which would send them a session cookie / write a session each time)
+    g.user_id = user_id
     return None
 
+
+def auth_required(view):
+    """Decorator: reject unauthenticated requests, otherwise expose the user as g.user_id"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        auth_error = require_auth()
+        if auth_error:
+            return auth_error
+        return view(*args, **kwargs)
+    return wrapper
+
+
+# Body of the plain {"success": true} reply, encoded once. Each call still builds its
+# own Response, since after_request handlers (CORS) modify the object they're given.
+_OK_JSON = b'{"success":true}\n'
+
+
+def ok_response():
+    """JSON {"success": true} response"""
+    return Response(_OK_JSON, mimetype='application/json')
+
 def upload_video_to_remote(file_path, filename, youtube_url, title, user_id, video_id):
     """Upload video file to remote server"""
     if not REMOTE_SERVER_URL:
@@ -366,14 +727,7 @@ def upload_video_to_remote(file_path, filename, youtube_url, title, user_id, vid
         if local_user and local_user.get('oauth_provider'):
             oauth_provider = local_user['oauth_provider']
             # Need to get OAuth ID from database
-            from database import execute_sql, fetch_one
-            conn = get_db()
-            cursor = conn.cursor()
-            execute_sql(cursor, 'SELECT oauth_id FROM users WHERE id = ?', (user_id,))
-            user_row = fetch_one(cursor)
-            conn.close()
-            if user_row and user_row.get('oauth_id'):
-                oauth_id = user_row['oauth_id']
+            oauth_id = get_user_oauth_id(user_id)
         
         upload_url = f"{REMOTE_SERVER_URL}/api/upload-video"
         
@@ -397,7 +751,7 @@ def upload_video_to_remote(file_path, filename, youtube_url, title, user_id, vid
                 print(f"[{video_id}] Uploading {filename} ({file_path.stat().st_size / 1024 / 1024:.2f} MB) to {upload_url}...")
                 print(f"[{video_id}]   - Using user_id: {user_id} (fallback - OAuth not available)")
             
-            response = requests.post(
+            response = http_session.post(
                 upload_url,
                 files=files,
                 data=data,
@@ -413,7 +767,6 @@ def upload_video_to_remote(file_path, filename, youtube_url, title, user_id, vid
                 
     except Exception as e:
         print(f"[{video_id}] Upload error: {str(e)}")
-        import traceback
         traceback.print_exc()
         return False
 
@@ -423,31 +776,32 @@ def run_ytdlp(video_id, url):
     output_path = VIDEOS_DIR / f"{video_id}.mp4"
     
     # Preserve existing download info (youtube_url, user_id) if present
-    existing_info = downloads.get(video_id, {})
-    user_id = existing_info.get("user_id")
-    downloads[video_id] = {
-        "status": "downloading",
-        "progress": 0,
-        "title": "Fetching...",
-        "filename": None,
-        "error": None,
-        "youtube_url": existing_info.get("youtube_url", url),
-        "user_id": user_id
-    }
-    
+    with downloads_lock:
+        existing_info = downloads.get(video_id)
+        user_id = existing_info.user_id if existing_info else None
+        _register_download(video_id, DownloadState(
+            user_id=user_id,
+            youtube_url=existing_info.youtube_url if existing_info else url,
+            status="downloading"
+        ))
+    
+    # Per-download copy of the user's cookies; removed in the finally below on every path
+    user_cookies_file = None
     try:
         # Get user-specific cookies from database, fallback to global cookies file
-        user_cookies_data = None
         cookies_file_to_use = None
         cookie_source = "none"
         
         if user_id:
-            from database import get_user_youtube_cookies
-            user_cookies_data = get_user_youtube_cookies(user_id)
-            if user_cookies_data:
-                # Create temporary cookies file for this user
-                user_cookies_file = VIDEOS_DIR / f"cookies_{user_id}_{video_id}.txt"
-                user_cookies_file.write_text(user_cookies_data)
+            user_cookies_mirror = get_user_youtube_cookies_file(user_id)
+            if user_cookies_mirror:
+                # yt-dlp writes the cookie jar back when it exits, so give each download
+                # its own copy of the user's mirrored file (kept out of VIDEOS_DIR so it
+                # is never servable and doesn't invalidate the local video index)
+                user_cookies_file = user_cookies_mirror.with_name(f"{user_cookies_mirror.stem}.{video_id}.dl.txt")
+                # Created 0o600 like the mirror: it holds the user's YouTube session
+                with open(user_cookies_mirror, 'rb') as src, open_private_file(user_cookies_file) as dst:
+                    shutil.copyfileobj(src, dst)
                 cookies_file_to_use = user_cookies_file
                 cookie_source = "user database"
                 print(f"[{video_id}] Using user-specific cookies from database (user_id: {user_id})")
@@ -461,15 +815,7 @@ def run_ytdlp(video_id, url):
         has_cookies = cookies_file_to_use is not None
         
         # Rotate user agents to appear more like real browsers
-        # Using desktop Chrome user agents (more reliable than mobile)
-        user_agents = [
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36 Edg/119.0.0.0",
-        ]
-        import random
-        user_agent = random.choice(user_agents)
+        user_agent = random.choice(YTDLP_USER_AGENTS)
         
         # Client selection strategy:
         # - With cookies + direct connection: try mweb first (better quality, supports cookies)
@@ -483,20 +829,13 @@ def run_ytdlp(video_id, url):
             # android client - more reliable with proxies, doesn't require PO tokens or cookies
             player_client = "android"
         
-        # Build extractor args - PO Token Provider plugin will automatically add PO Tokens when needed
-        extractor_args = f"youtube:player_client={player_client}"
+        extractor_args = YTDLP_EXTRACTOR_ARGS[player_client]
         
         info_cmd = [
-            "yt-dlp",
+            YTDLP_BIN,
             "--extractor-args", extractor_args,
             "--user-agent", user_agent,
-            "--referer", "https://www.youtube.com/",
-            "--add-header", "Accept-Language:en-US,en;q=0.9",
-            "--add-header", "Accept:text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-            "--add-header", "Accept-Encoding:gzip, deflate",
-            "--add-header", "DNT:1",
-            "--add-header", "Connection:keep-alive",
-            "--add-header", "Upgrade-Insecure-Requests:1",
+            *YTDLP_STATIC_HEADER_ARGS,
         ]
         
         # Strategy: Try direct connection first, then proxy as fallback
@@ -511,15 +850,23 @@ def run_ytdlp(video_id, url):
         else:
             print(f"[{video_id}] WARNING: No cookies found. Downloads may fail due to bot detection. Please add your YouTube cookies in Settings.")
         
+        # Only the title is needed - printing it avoids dumping (and parsing) the full info JSON
         info_cmd.extend([
-            "--dump-json",
+            "--print", "title",
             "--no-download",
             url
         ])
         
-        # Try direct connection first (works locally, may fail on Render)
-        print(f"[{video_id}] Fetching video info (direct connection)...")
-        info_result = subprocess.run(info_cmd, capture_output=True, text=True)
+        # The probe's only other job is deciding whether to fall back to the proxy or
+        # the android client. With android and no proxy there is nothing to fall back
+        # to, so skip the extra yt-dlp run - the download itself reports the title.
+        if player_client == "android" and not YOUTUBE_PROXY:
+            print(f"[{video_id}] Skipping info fetch (no fallbacks to choose between)")
+            info_result = subprocess.CompletedProcess(info_cmd, 0, stdout='', stderr='')
+        else:
+            # Try direct connection first (works locally, may fail on Render)
+            print(f"[{video_id}] Fetching video info (direct connection)...")
+            info_result = subprocess.run(info_cmd, capture_output=True, text=True, close_fds=False)
         
         # If direct connection fails and proxy is configured, try with proxy
         if info_result.returncode != 0 and YOUTUBE_PROXY:
@@ -544,7 +891,7 @@ def run_ytdlp(video_id, url):
                 if player_client == "mweb":
                     print(f"[{video_id}] Switching to android client for proxy (more reliable)")
                     player_client = "android"
-                    extractor_args = f"youtube:player_client={player_client}"
+                    extractor_args = YTDLP_EXTRACTOR_ARGS[player_client]
                     # Update info_cmd with new client
                     extractor_idx = info_cmd.index("--extractor-args")
                     info_cmd[extractor_idx + 1] = extractor_args
@@ -562,8 +909,8 @@ def run_ytdlp(video_id, url):
                         proxy_info_cmd.pop(cookies_idx)  # Remove cookies file path
                         print(f"[{video_id}] Removed cookies (android client doesn't support cookies)")
                 
-                # Insert proxy before --dump-json (which is at index -3: --dump-json, --no-download, url)
-                proxy_idx = len(proxy_info_cmd) - 3
+                # Insert proxy before --print (which is at index -4: --print, title, --no-download, url)
+                proxy_idx = len(proxy_info_cmd) - 4
                 proxy_info_cmd.insert(proxy_idx, "--proxy")
                 proxy_info_cmd.insert(proxy_idx + 1, proxy_to_use)
                 
@@ -586,7 +933,7 @@ def run_ytdlp(video_id, url):
                         username = username_part.split('://')[1].split(':')[0]
                         print(f"[{video_id}] Proxy username: {username}")
                 
-                info_result = subprocess.run(proxy_info_cmd, capture_output=True, text=True)
+                info_result = subprocess.run(proxy_info_cmd, capture_output=True, text=True, close_fds=False)
                 
                 # Log yt-dlp output for debugging
                 if info_result.returncode != 0:
@@ -615,7 +962,7 @@ def run_ytdlp(video_id, url):
                     http_display = http_proxy.split('@')[-1] if '@' in http_proxy else http_proxy
                     print(f"[{video_id}] Retrying with HTTP proxy: {http_display}")
                     print(f"[{video_id}] Adding --no-check-certificate for HTTP proxy")
-                    info_result = subprocess.run(alt_info_cmd, capture_output=True, text=True)
+                    info_result = subprocess.run(alt_info_cmd, capture_output=True, text=True, close_fds=False)
                     if info_result.returncode == 0:
                         proxy_to_use = http_proxy  # Use the working format for download
                         print(f"[{video_id}] HTTP proxy succeeded!")
@@ -634,12 +981,11 @@ def run_ytdlp(video_id, url):
             if html_content:
                 # Unlocker API can fetch the page, so YouTube is accessible
                 # Extract basic video info from HTML (title, etc.)
-                import re
-                title_match = re.search(r'<title>([^<]+)</title>', html_content)
+                title_match = _HTML_TITLE_RE.search(html_content)
                 if title_match:
                     title = title_match.group(1).replace(' - YouTube', '').strip()
                     print(f"[{video_id}] Unlocker API extracted title: {title}")
-                    downloads[video_id]["title"] = title
+                    downloads[video_id].title = title
                 
                 # Note: yt-dlp still needs to make its own requests for video download
                 # The Unlocker API HTTP endpoint confirms YouTube is accessible
@@ -654,20 +1000,14 @@ def run_ytdlp(video_id, url):
             if any(keyword in error_output for keyword in ['po token', 'format is not available', 'only images', 'challenge solving failed', 'gvs po token']):
                 print(f"[{video_id}] mweb client failed, trying android client as fallback...")
                 player_client = "android"
-                extractor_args = f"youtube:player_client={player_client}"
+                extractor_args = YTDLP_EXTRACTOR_ARGS[player_client]
                 
                 # Build new command with android client (no cookies for android)
                 android_info_cmd = [
-                    "yt-dlp",
+                    YTDLP_BIN,
                     "--extractor-args", extractor_args,
                     "--user-agent", user_agent,
-                    "--referer", "https://www.youtube.com/",
-                    "--add-header", "Accept-Language:en-US,en;q=0.9",
-                    "--add-header", "Accept:text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-                    "--add-header", "Accept-Encoding:gzip, deflate",
-                    "--add-header", "DNT:1",
-                    "--add-header", "Connection:keep-alive",
-                    "--add-header", "Upgrade-Insecure-Requests:1",
+                    *YTDLP_STATIC_HEADER_ARGS,
                 ]
                 
                 # Add proxy if we were using it
@@ -679,13 +1019,13 @@ def run_ytdlp(video_id, url):
                         android_info_cmd.extend(["--no-check-certificate"])
                 
                 android_info_cmd.extend([
-                    "--dump-json",
+                    "--print", "title",
                     "--no-download",
                     url
                 ])
                 
                 print(f"[{video_id}] Fetching video info with android client...")
-                info_result = subprocess.run(android_info_cmd, capture_output=True, text=True)
+                info_result = subprocess.run(android_info_cmd, capture_output=True, text=True, close_fds=False)
                 if info_result.returncode == 0:
                     print(f"[{video_id}] android client succeeded!")
                 else:
@@ -693,9 +1033,10 @@ def run_ytdlp(video_id, url):
                     print(f"[{video_id}] stderr: {info_result.stderr}")
         
         if info_result.returncode == 0:
-            info = json.loads(info_result.stdout)
-            downloads[video_id]["title"] = info.get("title", "Unknown")
-            print(f"[{video_id}] Title: {downloads[video_id]['title']}")
+            title_lines = info_result.stdout.strip().splitlines()
+            if title_lines:
+                downloads[video_id].title = title_lines[-1]
+                print(f"[{video_id}] Title: {downloads[video_id].title}")
         else:
             print(f"[{video_id}] Warning: Could not fetch video info")
             print(f"[{video_id}] stderr: {info_result.stderr}")
@@ -721,16 +1062,10 @@ def run_ytdlp(video_id, url):
         # Now download - ensuring merged audio+video output
         # Use same client and extractor args as info fetch (may have been changed to android if mweb failed)
         cmd = [
-            "yt-dlp",
+            YTDLP_BIN,
             "--extractor-args", extractor_args,  # Use the working client (may be android if mweb failed)
             "--user-agent", user_agent,
-            "--referer", "https://www.youtube.com/",
-            "--add-header", "Accept-Language:en-US,en;q=0.9",
-            "--add-header", "Accept:text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-            "--add-header", "Accept-Encoding:gzip, deflate",
-            "--add-header", "DNT:1",
-            "--add-header", "Connection:keep-alive",
-            "--add-header", "Upgrade-Insecure-Requests:1",
+            *YTDLP_STATIC_HEADER_ARGS,
         ]
         
         # Add proxy if we used it successfully for info fetch
@@ -756,6 +1091,10 @@ def run_ytdlp(video_id, url):
             "-o", str(output_path),  # Direct output path
             "--no-playlist",
             "--progress",  # Show progress
+            # Report the title as soon as it's known (picked up in the output loop below);
+            # --print implies --quiet, so turn normal output back on
+            "--print", "before_dl:" + _YTDLP_TITLE_MARKER.decode() + "%(title)s",
+            "--no-quiet",
             url
         ])
         
@@ -771,28 +1110,50 @@ def run_ytdlp(video_id, url):
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1  # Line buffered
+            close_fds=False,
+            bufsize=0  # Raw pipe - read in chunks and split into lines below
         )
         
-        for line in process.stdout:
-            line = line.strip()
-            if line:  # Only print non-empty lines
-                print(f"[{video_id}] {line}")
-            
-            # Parse progress
-            if "[download]" in line and "%" in line:
-                try:
-                    # Extract percentage like "45.2%"
-                    percent_str = line.split("%")[0].split()[-1]
-                    downloads[video_id]["progress"] = float(percent_str)
-                except (ValueError, IndexError):
-                    pass
-            
-            # Also update progress during merge
-            if "[Merger]" in line or "Merging" in line:
-                downloads[video_id]["progress"] = 95
+        stdout_fd = process.stdout.fileno()
+        pending = b''
+        last_logged_step = None
+        while True:
+            chunk = os.read(stdout_fd, 65536)
+            if not chunk:
+                break
+            *lines, pending = _YTDLP_LINE_SPLIT_RE.split(pending + chunk)
+            # A chunk usually holds several progress redraws - only the last one matters
+            latest_progress = None
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+                
+                # Parse progress like "[download]  45.2% of 10.00MiB"
+                match = _YTDLP_PROGRESS_RE.match(line)
+                if match:
+                    latest_progress = match
+                    step = int(float(match.group(1))) // PROGRESS_LOG_STEP
+                    if step == last_logged_step:
+                        continue
+                    last_logged_step = step
+                # Also update progress during merge
+                elif _YTDLP_MERGE_RE.search(line):
+                    latest_progress = None
+                    downloads[video_id].progress = 95
+                elif line.startswith(_YTDLP_TITLE_MARKER):
+                    title = line[len(_YTDLP_TITLE_MARKER):].decode('utf-8', 'replace').strip()
+                    if title:
+                        downloads[video_id].title = title
+                    continue
+                
+                print(f"[{video_id}] {line.decode('utf-8', 'replace')}")
+            if latest_progress:
+                downloads[video_id].update_progress(float(latest_progress.group(1)))
+        if pending.strip():
+            print(f"[{video_id}] {pending.strip().decode('utf-8', 'replace')}")
         
+        process.stdout.close()
         process.wait()
         
         print(f"[{video_id}] Process finished with return code: {process.returncode}")
@@ -802,27 +1163,33 @@ def run_ytdlp(video_id, url):
             if output_path.exists():
                 filename = output_path.name
                 file_size = output_path.stat().st_size
-                downloads[video_id]["filename"] = filename
-                downloads[video_id]["status"] = "complete"
-                downloads[video_id]["progress"] = 100
+                invalidate_local_video_index()
+                downloads[video_id].filename = filename
+                downloads[video_id].status = "complete"
+                downloads[video_id].progress = 100
                 print(f"[{video_id}] Download complete: {filename}")
                 print(f"[{video_id}] File size: {file_size / 1024 / 1024:.2f} MB")
                 
-                # Upload to R2 if enabled
+                # Upload to R2 if enabled - runs in the background while the video
+                # is registered; the local file keeps serving until it lands
                 if R2_ENABLED:
                     print(f"[{video_id}] Uploading to R2...")
-                    if upload_to_r2(output_path, filename):
-                        print(f"[{video_id}] ✓ Video uploaded to R2")
-                        # Optionally delete local file to save disk space (uncomment if desired)
-                        # output_path.unlink()
-                        # print(f"[{video_id}] Local file deleted (stored in R2 only)")
-                    else:
-                        print(f"[{video_id}] ⚠ Failed to upload to R2, keeping local file")
+                    upload_future = upload_to_r2_async(output_path, filename)
+                    if upload_future:
+                        r2_uploads[video_id] = upload_future
+                        
+                        def _report_upload(future, video_id=video_id):
+                            r2_uploads.pop(video_id, None)
+                            if future.exception() is None and future.result():
+                                print(f"[{video_id}] ✓ Video uploaded to R2")
+                            else:
+                                print(f"[{video_id}] ⚠ Failed to upload to R2, keeping local file")
+                        upload_future.add_done_callback(_report_upload)
                 
                 # Register video in shared storage and add to user's library
-                youtube_url = downloads[video_id].get("youtube_url")
-                title = downloads[video_id].get("title", filename)
-                user_id = downloads[video_id].get("user_id")
+                youtube_url = downloads[video_id].youtube_url
+                title = downloads[video_id].title or filename
+                user_id = downloads[video_id].user_id
                 
                 print(f"[{video_id}] Attempting to register video:")
                 print(f"[{video_id}]   - user_id: {user_id}")
@@ -834,15 +1201,15 @@ def run_ytdlp(video_id, url):
                 if not user_id:
                     error_msg = "No user_id found in download info"
                     print(f"[{video_id}] ERROR: {error_msg}")
-                    downloads[video_id]["status"] = "error"
-                    downloads[video_id]["error"] = error_msg
+                    downloads[video_id].status = "error"
+                    downloads[video_id].error = error_msg
                     return
                 
                 if not youtube_url:
                     error_msg = "No youtube_url found in download info"
                     print(f"[{video_id}] ERROR: {error_msg}")
-                    downloads[video_id]["status"] = "error"
-                    downloads[video_id]["error"] = error_msg
+                    downloads[video_id].status = "error"
+                    downloads[video_id].error = error_msg
                     return
                 
                 try:
@@ -852,6 +1219,14 @@ def run_ytdlp(video_id, url):
                         upload_success = upload_video_to_remote(output_path, filename, youtube_url, title, user_id, video_id)
                         if upload_success:
                             print(f"[{video_id}] ✓ Video uploaded to remote server successfully")
+                            # A background R2 upload reopens the file for every part, so let
+                            # it finish before the file goes away
+                            pending_upload = r2_uploads.get(video_id)
+                            if pending_upload is not None:
+                                try:
+                                    pending_upload.result()
+                                except Exception:
+                                    pass  # _report_upload logs the failure
                             # Clean up local file after successful upload
                             try:
                                 output_path.unlink()
@@ -859,7 +1234,7 @@ def run_ytdlp(video_id, url):
                             except Exception as e:
                                 print(f"[{video_id}] Warning: Could not delete local file: {e}")
                             # Remote upload succeeded, don't register locally
-                            downloads[video_id]["status"] = "complete"
+                            downloads[video_id].status = "complete"
                             return
                         else:
                             print(f"[{video_id}] ⚠ Remote upload failed, falling back to local registration")
@@ -867,72 +1242,59 @@ def run_ytdlp(video_id, url):
                     
                     # Normal mode or fallback: Save locally and register in database
                     # Check if video already exists (shouldn't happen, but just in case)
-                    existing = get_video_by_youtube_url(youtube_url)
-                    if existing:
-                        video_db_id = existing['id']
-                        print(f"[{video_id}] Video already in shared storage (ID: {video_db_id}), using existing entry")
+                    # Find-or-create the shared video and add it to the user's library
+                    # in a single statement (one round trip, one commit)
+                    video_db_id, created = register_and_link_video(user_id, youtube_url, filename, title, file_size, {
+                        "title": title,
+                        "sourceUrl": youtube_url
+                    })
+                    if created:
+                        print(f"[{video_id}] ✓ Video registered in shared storage (ID: {video_db_id})")
                     else:
-                        # Create new video entry
-                        print(f"[{video_id}] Creating new video entry in database...")
-                        video_db_id = create_video(filename, youtube_url, title, file_size)
-                        if video_db_id:
-                            print(f"[{video_id}] ✓ Video registered in shared storage (ID: {video_db_id})")
-                        else:
-                            raise Exception("create_video returned None")
+                        print(f"[{video_id}] Video already in shared storage (ID: {video_db_id}), using existing entry")
+                    print(f"[{video_id}] ✓ Video added to user's library successfully (user_id: {user_id})")
                     
-                    # Add to user's library
-                    if video_db_id:
-                        print(f"[{video_id}] Adding video to user's library (user_id: {user_id}, video_id: {video_db_id})...")
-                        add_video_to_library(user_id, video_db_id, {
-                            "title": title,
-                            "sourceUrl": youtube_url
-                        })
-                        print(f"[{video_id}] ✓ Video added to user's library successfully")
-                        
-                        # Verify it was added
-                        from database import get_user_library
-                        user_lib = get_user_library(user_id)
-                        if filename in user_lib:
+                    # Verify it was added (debug only - costs a query per download)
+                    if app.debug:
+                        if library_has_video(user_id, video_db_id):
                             print(f"[{video_id}] ✓ Verified: Video appears in user's library")
                         else:
                             print(f"[{video_id}] ⚠ WARNING: Video not found in user's library after adding!")
                 except Exception as e:
                     error_msg = f"Error registering video: {str(e)}"
                     print(f"[{video_id}] ERROR: {error_msg}")
-                    import traceback
                     traceback.print_exc()
-                    downloads[video_id]["status"] = "error"
-                    downloads[video_id]["error"] = error_msg
+                    downloads[video_id].status = "error"
+                    downloads[video_id].error = error_msg
             else:
-                downloads[video_id]["status"] = "error"
-                downloads[video_id]["error"] = "Merged file not found after download"
+                downloads[video_id].status = "error"
+                downloads[video_id].error = "Merged file not found after download"
                 print(f"[{video_id}] ERROR: Merged file not found at {output_path}")
         else:
-            downloads[video_id]["status"] = "error"
-            downloads[video_id]["error"] = f"Download failed with code {process.returncode}"
+            downloads[video_id].status = "error"
+            downloads[video_id].error = f"Download failed with code {process.returncode}"
             print(f"[{video_id}] ERROR: Download failed")
-        
+            
+    except Exception as e:
+        downloads[video_id].status = "error"
+        downloads[video_id].error = str(e)
+        print(f"[{video_id}] EXCEPTION: {str(e)}")
+    finally:
         # Clean up temporary cookies file if we created one
-        if cookies_file_to_use and cookies_file_to_use != COOKIES_FILE and cookies_file_to_use.exists():
+        if user_cookies_file is not None:
             try:
-                cookies_file_to_use.unlink()
+                user_cookies_file.unlink()
                 print(f"[{video_id}] Cleaned up temporary cookies file")
+            except FileNotFoundError:
+                pass
             except Exception as e:
                 print(f"[{video_id}] Warning: Could not delete temporary cookies file: {e}")
-            
-    except Exception as e:
-        downloads[video_id]["status"] = "error"
-        downloads[video_id]["error"] = str(e)
-        print(f"[{video_id}] EXCEPTION: {str(e)}")
 
 
 @app.route("/api/download", methods=["POST"])
+@auth_required
 def start_download():
     """Start downloading a YouTube video (only available in local client mode)"""
-    auth_error = require_auth()
-    if auth_error:
-        return auth_error
-    
     # Disable YouTube downloads on web client (Render)
     if IS_WEB_CLIENT:
         return jsonify({
@@ -958,9 +1320,7 @@ def start_download():
         return jsonify({"error": "Please provide a YouTube URL"}), 400
     
     # Extract video ID to ensure it's a valid YouTube URL format
-    import re
-    youtube_pattern = r'(?:youtube\.com\/watch\?v=|youtu\.be\/)([a-zA-Z0-9_-]{11})'
-    match = re.search(youtube_pattern, url)
+    match = _YOUTUBE_URL_RE.search(url)
     if not match:
         return jsonify({"error": "Invalid YouTube URL format"}), 400
     
@@ -971,6 +1331,7 @@ def start_download():
         filename = existing_video['filename']
         file_exists = False
         
+        release_request_db()
         if R2_ENABLED and file_exists_in_r2(filename):
             file_exists = True
         else:
@@ -980,17 +1341,17 @@ def start_download():
         
         if file_exists:
             # Video exists, return immediately
-            user_id = get_current_user_id()
+            user_id = g.user_id
             # Add to user's library if not already there
             video_db_id = existing_video['id']
-            # Check if user already has it
-            user_lib = get_user_library(user_id)
-            if existing_video['filename'] not in user_lib:
-                # Add to library with default metadata
-                add_video_to_library(user_id, video_db_id, {
-                    "title": existing_video['title'] or existing_video['filename'],
-                    "sourceUrl": url
-                })
+            # Check if user already has it (one connection for the check and the insert)
+            with db_session() as (conn, cursor):
+                if not library_has_video_with(cursor, user_id, video_db_id):
+                    # Add to library with default metadata
+                    add_video_to_library_with(cursor, user_id, video_db_id, {
+                        "title": existing_video['title'] or existing_video['filename'],
+                        "sourceUrl": url
+                    })
             
             return jsonify({
                 "id": "existing",
@@ -1000,23 +1361,16 @@ def start_download():
                 "message": "Video already downloaded"
             })
     
-    video_id = str(uuid.uuid4())[:8]
-    user_id = get_current_user_id()
+    video_id = secrets.token_hex(4)
+    user_id = g.user_id
     
     # Store user_id and URL with download for tracking
-    downloads[video_id] = {
-        "user_id": user_id,
-        "youtube_url": url,
-        "status": "starting",
-        "progress": 0,
-        "title": "Fetching...",
-        "filename": None,
-        "error": None
-    }
-    
-    # Start download in background thread
-    thread = threading.Thread(target=run_ytdlp, args=(video_id, url))
-    thread.start()
+    prune_finished_downloads()
+    with downloads_lock:
+        _register_download(video_id, DownloadState(user_id=user_id, youtube_url=url))
+    
+    # Start download on the bounded download pool
+    submit_download(video_id, url)
     
     return jsonify({"id": video_id})
 
@@ -1037,7 +1391,6 @@ def upload_video():
         oauth_id = request.form.get('oauth_id')
         print(f"[upload] OAuth matching: {oauth_provider}/{oauth_id}")
         # Look up user by OAuth ID (this ensures correct user across different databases)
-        from database import get_user_by_oauth
         user = get_user_by_oauth(oauth_provider, oauth_id)
         if user:
             user_id = user['id']
@@ -1049,7 +1402,6 @@ def upload_video():
         user_id = int(request.form.get('user_id'))
         print(f"[upload] User ID from form data (fallback): {user_id}")
         # Verify user exists in database
-        from database import get_user_by_id
         user = get_user_by_id(user_id)
         if not user:
             return jsonify({"error": f"User {user_id} not found"}), 404
@@ -1076,6 +1428,8 @@ def upload_video():
         filename = video_file.filename
         filepath = VIDEOS_DIR / filename
         video_file.save(str(filepath))
+        # Overwriting an existing name doesn't change the directory mtime
+        invalidate_local_video_index()
         file_size = filepath.stat().st_size
         
         print(f"[upload] Received video upload: {filename} ({file_size / 1024 / 1024:.2f} MB)")
@@ -1085,6 +1439,7 @@ def upload_video():
         
         # Upload to R2 if enabled
         if R2_ENABLED:
+            release_request_db()
             print(f"[upload] Uploading to R2...")
             if upload_to_r2(filepath, filename):
                 print(f"[upload] ✓ Video uploaded to R2")
@@ -1100,7 +1455,6 @@ def upload_video():
             existing = get_video_by_youtube_url(youtube_url)
         else:
             # For direct MP4 uploads without youtube_url, check by filename
-            from database import get_video_by_filename
             existing = get_video_by_filename(filename)
         
         if existing:
@@ -1141,33 +1495,24 @@ def upload_video():
 
 
 @app.route("/api/download/<video_id>", methods=["GET"])
+@auth_required
 def get_download_status(video_id):
     """Get the status of a download"""
-    auth_error = require_auth()
-    if auth_error:
-        return auth_error
-    
-    user_id = get_current_user_id()
-    if video_id not in downloads:
-        return jsonify({"error": "Download not found"}), 404
+    user_id = g.user_id
+    state = get_download_snapshot(video_id)
     
     # Only return download if it belongs to current user
-    if downloads[video_id].get("user_id") != user_id:
+    if state is None or state['user_id'] != user_id:
         return jsonify({"error": "Download not found"}), 404
     
-    return jsonify(downloads[video_id])
+    # Flag a finished download whose R2 upload is still in flight
+    return jsonify({**state, "uploading": video_id in r2_uploads})
 
 
 def extract_video_id_from_url(url):
     """Extract YouTube video ID from URL"""
-    import re
-    patterns = [
-        r'[?&]v=([^&]+)',
-        r'youtu\.be/([^?&]+)',
-        r'^([a-zA-Z0-9_-]{11})$'
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, url)
+    for pattern in _VIDEO_ID_RES:
+        match = pattern.search(url)
         if match:
             return match.group(1)
     return None
@@ -1179,91 +1524,91 @@ def extract_video_id_from_url(url):
 
 
 @app.route("/api/videos", methods=["GET"])
+@auth_required
 def list_videos():
     """List videos in user's library (only shows videos the user has added)"""
-    auth_error = require_auth()
-    if auth_error:
-        return auth_error
-    
-    user_id = get_current_user_id()
-    user_library = get_user_library(user_id)
+    user_id = g.user_id
+    start_video_file_sweep()
     
+    local_sizes = get_local_video_sizes()
     videos = []
-    # Only show videos that are in the user's library
-    for filename, metadata in user_library.items():
-        # Check if file exists in R2 or locally
-        file_exists = False
-        file_size = None
-        
-        if R2_ENABLED and file_exists_in_r2(filename):
-            file_exists = True
+    # Only show videos that are in the user's library; rows are already fetched,
+    # so don't keep the connection through any R2 HEADs below
+    rows = get_user_videos(user_id)
+    release_request_db()
+    for row in rows:
+        filename = row['filename']
+        metadata = row['metadata']
+        
+        # Local files are checked against the cached directory index; for R2 trust
+        # the size recorded at registration (the background sweep drops files that
+        # have gone missing) and only HEAD the object when no size was recorded
+        if filename in local_sizes:
+            file_size = local_sizes[filename]
+        elif not R2_ENABLED or filename in _missing_video_files:
+            continue
+        elif row['file_size'] is not None:
+            file_size = row['file_size']
+        elif file_exists_in_r2(filename):
             file_size = get_file_size_from_r2(filename) or 0
         else:
-            filepath = VIDEOS_DIR / filename
-            if filepath.exists():
-                file_exists = True
-                file_size = filepath.stat().st_size
+            continue
         
-        if file_exists:
-            videos.append({
-                "id": filename.split('.')[0],  # Use filename without extension as ID
-                "filename": filename,
-                "title": metadata.get("title", filename),
-                "size": file_size
-            })
+        videos.append({
+            "id": filename.split('.')[0],  # Use filename without extension as ID
+            "filename": filename,
+            "title": metadata.get("title", filename),
+            "size": file_size
+        })
     
     return jsonify(videos)
 
 
 @app.route("/api/videos/<filename>", methods=["DELETE"])
+@auth_required
 def delete_video(filename):
     """Remove video from user's library (only deletes file if no other users have it)"""
-    auth_error = require_auth()
-    if auth_error:
-        return auth_error
+    user_id = g.user_id
     
-    user_id = get_current_user_id()
-    
-    # Remove from user's library
-    removed = remove_video_from_library(user_id, filename)
+    # Remove from user's library and check whether anyone else still has it,
+    # all on one connection
+    with db_session() as (conn, cursor):
+        removed = remove_video_from_library_with(cursor, user_id, filename)
+        video = get_video_by_filename_with(cursor, filename) if removed else None
+        referenced = video is not None and video_is_referenced_with(cursor, video['id'])
+        # The exact count is only needed for the "still used by" message
+        ref_count = count_video_refs_with(cursor, video['id']) if referenced else 0
     
     if not removed:
         return jsonify({"error": "Video not found in your library"}), 404
     
-    # Check if any other users still have this video
-    video = get_video_by_filename(filename)
     if video:
-        ref_count = get_video_reference_count(video['id'])
-        
-        if ref_count == 0:
+        if not referenced:
             # No other users have it - delete the file
-            filepath = VIDEOS_DIR / filename
             files_deleted = []
             
             # Delete from R2 if enabled
             if R2_ENABLED:
+                release_request_db()
                 if delete_from_r2(filename):
                     files_deleted.append(f"{filename} (R2)")
             
-            # Delete local file if it exists
-            if filepath.exists():
-                filepath.unlink()
-                files_deleted.append(filename)
-            
-            # Also try to delete related files
+            # Delete the local file and related files (same base name, any extension)
+            # in one directory pass
             base_id = filename.split('.')[0]
-            for related_file in VIDEOS_DIR.glob(f"{base_id}.*"):
-                if related_file.name != filename and related_file.exists():
-                    related_file.unlink()
-                    files_deleted.append(related_file.name)
+            related_prefix = f"{base_id}."
+            with os.scandir(VIDEOS_DIR) as entries:
+                for entry in entries:
+                    if (entry.name == filename or entry.name.startswith(related_prefix)) and entry.is_file():
+                        try:
+                            os.unlink(entry.path)
+                        except FileNotFoundError:
+                            continue
+                        files_deleted.append(entry.name)
+            invalidate_local_video_index()
             
             # Delete from videos table (CASCADE will clean up library references)
-            from database import get_db, execute_sql
-            conn = get_db()
-            cursor = conn.cursor()
-            execute_sql(cursor, 'DELETE FROM videos WHERE id = ?', (video['id'],))
-            conn.commit()
-            conn.close()
+            delete_video_record(video['id'])
             
             return jsonify({
                 "success": True,
@@ -1283,6 +1628,57 @@ def delete_video(filename):
     return jsonify({"success": True, "deleted_from_library": True})
 
 
+def _send_local_video(filepath):
+    """Send a local video via wsgi.file_wrapper (sendfile under gunicorn), handling single Range requests"""
+    stat = filepath.stat()
+    size = stat.st_size
+    start, stop, status = 0, size, 200
+    
+    byte_range = request.range
+    if byte_range is not None and len(byte_range.ranges) == 1:
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            return Response('', 416, {'Content-Range': f'bytes */{size}', 'Accept-Ranges': 'bytes'})
+        start, stop = bounds
+        status = 206
+    
+    f = open(filepath, 'rb')
+    f.seek(start)
+    length = stop - start
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper:
+        # Servers must not send more than Content-Length, so the wrapper stops at `stop`
+        body = file_wrapper(f, 1024 * 1024)
+    else:
+        def body_chunks():
+            remaining = length
+            try:
+                while remaining > 0:
+                    chunk = f.read(min(1024 * 1024, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+            finally:
+                f.close()
+        body = body_chunks()
+    
+    response = Response(
+        body, status,
+        mimetype=mimetypes.guess_type(filepath.name)[0] or 'video/mp4',
+        direct_passthrough=True
+    )
+    response.headers['Content-Length'] = str(length)
+    response.headers['Accept-Ranges'] = 'bytes'
+    if status == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    # Same validators send_file would set, so reloads can be answered with a 304
+    response.last_modified = int(stat.st_mtime)
+    response.set_etag(f"{stat.st_mtime_ns:x}-{size:x}")
+    response.call_on_close(f.close)
+    return response.make_conditional(request)
+
+
 @app.route("/videos/<filename>")
 def serve_video(filename):
     """Serve a video file from R2 or local storage"""
@@ -1293,11 +1689,22 @@ def serve_video(filename):
     # Try R2 first if enabled, but fall back gracefully on any error
     if R2_ENABLED:
         try:
-            # Check if file exists in R2 first
-            if file_exists_in_r2(filename):
+            # Check if file exists in R2 first (cached HEAD, which also carries the ETag)
+            r2_info = get_r2_object_info(filename)
+            if r2_info is not None:
+                # Answer revalidation from the cached ETag without opening the object
+                r2_etag = r2_info.get('etag')
+                if r2_etag and request.if_none_match.contains(r2_etag.strip('"')):
+                    return Response(status=304, headers={
+                        'ETag': r2_etag,
+                        'Cache-Control': video_cache_control(filename),
+                        'Access-Control-Allow-Origin': '*',
+                    })
+                
                 # Instead of redirecting (which causes CORS issues), proxy the video through backend
-                # This allows us to add CORS headers
-                from r2_storage import s3_client, R2_BUCKET_NAME
+                # This allows us to add CORS headers. Look the client up each time
+                # so reset_r2_client() is picked up here too.
+                s3_client = get_r2_client()
                 if s3_client and R2_BUCKET_NAME:
                     try:
                         # Get the object from R2
@@ -1321,13 +1728,12 @@ def serve_video(filename):
                                 if not body:
                                     raise ValueError(f"No body in R2 response for {filename}")
                                 while True:
-                                    chunk = body.read(8192)
+                                    chunk = body.read(VIDEO_STREAM_CHUNK_SIZE)
                                     if not chunk:
                                         break
                                     yield chunk
                             except Exception as stream_error:
                                 print(f"✗ Error streaming video {filename}: {stream_error}")
-                                import traceback
                                 traceback.print_exc()
                                 raise
                         
@@ -1337,15 +1743,20 @@ def serve_video(filename):
                             'Access-Control-Allow-Origin': '*',
                             'Access-Control-Allow-Methods': 'GET, HEAD, OPTIONS',
                             'Access-Control-Allow-Headers': 'Range',
+                            'Cache-Control': video_cache_control(filename),
                         }
                         if content_length:
                             headers['Content-Length'] = str(content_length)
+                        if response.get('ETag'):
+                            headers['ETag'] = response['ETag']
+                        if response.get('LastModified'):
+                            headers['Last-Modified'] = http_date(response['LastModified'])
                         
                         # Handle Range requests for video seeking
                         range_header = request.headers.get('Range')
                         if range_header and content_length:
                             # Parse range header (e.g., "bytes=0-1023")
-                            match = re.match(r'bytes=(\d+)-(\d*)', range_header)
+                            match = _RANGE_HEADER_RE.match(range_header)
                             if match:
                                 start = int(match.group(1))
                                 end = int(match.group(2)) if match.group(2) else content_length - 1
@@ -1354,6 +1765,7 @@ def serve_video(filename):
                                 if start < 0 or start >= content_length:
                                     # Invalid range - return 416 Range Not Satisfiable
                                     headers['Content-Range'] = f'bytes */{content_length}'
+                                    headers.pop('Cache-Control', None)
                                     return Response('', 416, headers)
                                 
                                 if end >= content_length:
@@ -1375,7 +1787,7 @@ def serve_video(filename):
                                             try:
                                                 body = range_response['Body']
                                                 while True:
-                                                    chunk = body.read(8192)
+                                                    chunk = body.read(VIDEO_STREAM_CHUNK_SIZE)
                                                     if not chunk:
                                                         break
                                                     yield chunk
@@ -1407,7 +1819,19 @@ def serve_video(filename):
     # Fallback to local file if R2 not enabled or file not in R2
     filepath = VIDEOS_DIR / filename
     if filepath.exists():
-        response = send_from_directory(str(VIDEOS_DIR), filename)
+        if VIDEOS_ACCEL_REDIRECT_PREFIX:
+            # Hand the transfer (including Range handling) off to nginx, which keeps
+            # our Content-Type; the internal URI must be percent-encoded
+            response = Response(status=200, mimetype=mimetypes.guess_type(filename)[0] or 'video/mp4')
+            response.headers['X-Accel-Redirect'] = VIDEOS_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + quote(filename)
+        elif VIDEOS_X_SENDFILE:
+            # mod_xsendfile keeps our Content-Type, so set it explicitly
+            response = Response(status=200, mimetype=mimetypes.guess_type(filename)[0] or 'video/mp4')
+            response.headers['X-Sendfile'] = str(filepath.resolve())
+        else:
+            response = _send_local_video(filepath)
+        if response.status_code != 416:
+            response.headers['Cache-Control'] = video_cache_control(filename)
         # Add CORS headers to local file response
         response.headers['Access-Control-Allow-Origin'] = '*'
         response.headers['Access-Control-Allow-Methods'] = 'GET, HEAD, OPTIONS'
@@ -1427,7 +1851,87 @@ def serve_frontend():
 # Authentication Routes
 # ======================
 
+# Per-client limits on the auth endpoints, which hash passwords or start OAuth flows:
+# (max requests, window in seconds). Counted in Redis when available (shared by all
+# workers), otherwise in a per-process sliding window.
+AUTH_RATE_LIMITS = ((5, 60), (20, 3600))
+_rate_windows = {}  # (scope, client, window) -> deque of request times
+_rate_lock = threading.Lock()
+
+
+def _rate_limited_locally(scope, client, limits, now):
+    """Check every sliding window, then record the hit only if all allow it
+
+    Returns the window (seconds) that rejected the request, or None.
+    """
+    with _rate_lock:
+        windows = []
+        for limit, window in limits:
+            key = (scope, client, window)
+            hits = _rate_windows.get(key)
+            if hits is None:
+                # Forget idle clients now and then so the dict doesn't grow without bound
+                if len(_rate_windows) > 10000:
+                    for stale in [k for k, q in _rate_windows.items() if not q or q[-1] <= now - k[2]]:
+                        del _rate_windows[stale]
+                hits = _rate_windows[key] = deque()
+            while hits and hits[0] <= now - window:
+                hits.popleft()
+            if len(hits) >= limit:
+                return window
+            windows.append(hits)
+        for hits in windows:
+            hits.append(now)
+        return None
+
+
+def _rate_limited_in_redis(scope, client, limits, now):
+    """Count the hit in every fixed Redis window, undoing it if any window is over
+
+    Returns the window (seconds) that rejected the request, or None.
+    """
+    keys = [f"rl:{scope}:{client}:{window}:{int(now // window)}" for _, window in limits]
+    pipe = redis_client.pipeline()
+    for key, (_, window) in zip(keys, limits):
+        pipe.incr(key)
+        pipe.expire(key, window)
+    counts = pipe.execute()[::2]
+    for count, (limit, window) in zip(counts, limits):
+        if count > limit:
+            # Rejected requests don't count, so a throttled client's lockout doesn't grow
+            pipe = redis_client.pipeline()
+            for key in keys:
+                pipe.decr(key)
+            pipe.execute()
+            return window
+    return None
+
+
+def rate_limited(scope, limits=AUTH_RATE_LIMITS):
+    """Decorator: answer 429 once a client exceeds any of the (count, seconds) limits"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            client = request.remote_addr or 'unknown'
+            now = time.time()
+            try:
+                if redis_client is not None:
+                    rejected_window = _rate_limited_in_redis(scope, client, limits, now)
+                else:
+                    rejected_window = _rate_limited_locally(scope, client, limits, now)
+            except Exception as e:
+                print(f"⚠ Rate limit check failed, allowing request: {e}")
+                rejected_window = None
+            if rejected_window is not None:
+                response = jsonify({"error": "Too many attempts, please try again later"})
+                response.headers['Retry-After'] = str(rejected_window)
+                return response, 429
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
 @app.route("/api/auth/register", methods=["POST"])
+@rate_limited('register')
 def register():
     """Register a new user"""
     data = request.json
@@ -1446,6 +1950,7 @@ def register():
     
     user = create_user(username, email, password)
     if user:
+        invalidate_user(user['id'])
         session['user_id'] = user['id']
         session['username'] = user['username']
         return jsonify({"success": True, "user": user}), 201
@@ -1454,6 +1959,7 @@ def register():
 
 
 @app.route("/api/auth/login", methods=["POST"])
+@rate_limited('login')
 def login():
     """Login user"""
     data = request.json
@@ -1465,6 +1971,7 @@ def login():
     
     user = verify_user(username, password)
     if user:
+        invalidate_user(user['id'])
         session['user_id'] = user['id']
         session['username'] = user['username']
         return jsonify({"success": True, "user": user})
@@ -1475,8 +1982,13 @@ def login():
 @app.route("/api/auth/logout", methods=["POST"])
 def logout():
     """Logout user"""
+    invalidate_user(get_current_user_id())
     session.clear()
-    return jsonify({"success": True})
+    return ok_response()
+
+
+# /api/auth/me is hit on every page load; the logged-out answer is encoded once
+_UNAUTH_ME_JSON = b'{"authenticated":false}\n'
 
 
 @app.route("/api/auth/me", methods=["GET"])
@@ -1489,7 +2001,6 @@ def get_current_user():
     if not user_id:
         auth_token = request.args.get('token') or request.headers.get('X-Auth-Token')
         if auth_token and hasattr(app, 'auth_tokens') and auth_token in app.auth_tokens:
-            import time
             token_data = app.auth_tokens[auth_token]
             # Check if token expired
             if time.time() < token_data['expires']:
@@ -1499,28 +2010,25 @@ def get_current_user():
                 del app.auth_tokens[auth_token]
     
     if not user_id:
-        return jsonify({"authenticated": False}), 200
+        return Response(_UNAUTH_ME_JSON, mimetype='application/json')
     
-    user = get_user_by_id(user_id)
+    user = get_cached_user(user_id)
     if user:
-        # Check if user has cookies configured
-        from database import get_user_youtube_cookies
-        has_cookies = get_user_youtube_cookies(user_id) is not None
-        user["has_youtube_cookies"] = has_cookies
+        user = dict(user, has_youtube_cookies=user_has_youtube_cookies(user_id))
         return jsonify({"authenticated": True, "user": user})
     else:
         session.clear()
-        return jsonify({"authenticated": False}), 200
+        return Response(_UNAUTH_ME_JSON, mimetype='application/json')
+
+
+NETSCAPE_COOKIE_HEADERS = ('# Netscape HTTP Cookie File', '# HTTP Cookie File')
 
 
 @app.route("/api/auth/cookies", methods=["POST"])
+@auth_required
 def save_user_cookies():
     """Save YouTube cookies for the current user"""
-    auth_error = require_auth()
-    if auth_error:
-        return auth_error
-    
-    user_id = get_current_user_id()
+    user_id = g.user_id
     data = request.json
     cookies_data = data.get("cookies")
     
@@ -1528,34 +2036,30 @@ def save_user_cookies():
         return jsonify({"error": "No cookies data provided"}), 400
     
     # Validate it looks like Netscape cookie format
-    if not (cookies_data.startswith('# Netscape HTTP Cookie File') or 
-            cookies_data.startswith('# HTTP Cookie File')):
+    if not cookies_data.startswith(NETSCAPE_COOKIE_HEADERS):
         return jsonify({"error": "Invalid cookie format. Please export cookies in Netscape format."}), 400
     
-    from database import set_user_youtube_cookies
     success = set_user_youtube_cookies(user_id, cookies_data)
     
     if success:
+        invalidate_user(user_id)
         return jsonify({"message": "Cookies saved successfully"})
     else:
         return jsonify({"error": "Failed to save cookies"}), 500
 
 
 @app.route("/api/auth/cookies", methods=["GET"])
+@auth_required
 def get_user_cookies_status():
     """Get whether user has cookies configured (without returning the actual cookies)"""
-    auth_error = require_auth()
-    if auth_error:
-        return auth_error
-    
-    user_id = get_current_user_id()
-    from database import get_user_youtube_cookies
-    has_cookies = get_user_youtube_cookies(user_id) is not None
+    user_id = g.user_id
+    has_cookies = user_has_youtube_cookies(user_id)
     
     return jsonify({"has_cookies": has_cookies})
 
 
 @app.route("/api/auth/google", methods=["GET"])
+@rate_limited('google')
 def google_login():
     """Initiate Google OAuth login"""
     # Get frontend URL for error redirects
@@ -1582,7 +2086,6 @@ def google_login():
         return google.authorize_redirect(redirect_uri)
     except Exception as e:
         print(f"OAuth redirect error: {str(e)}")
-        import traceback
         traceback.print_exc()
         return redirect(f"{frontend_origin}#/login?error=oauth_error")
 
@@ -1599,17 +2102,20 @@ def google_callback():
     try:
         token = google.authorize_access_token()
         
-        # Fetch user info from Google
-        import requests
-        user_info_response = requests.get(
-            'https://www.googleapis.com/oauth2/v2/userinfo',
-            headers={'Authorization': f"Bearer {token['access_token']}"}
-        )
-        
-        if user_info_response.status_code != 200:
-            return redirect(f"{frontend_url}#/login?error=oauth_failed")
-        
-        user_info = user_info_response.json()
+        # Authlib verifies the id_token against Google's JWKS and exposes its claims,
+        # so the userinfo endpoint is only needed if no id_token came back
+        user_info = token.get('userinfo')
+        if not user_info:
+            user_info_response = http_session.get(
+                'https://www.googleapis.com/oauth2/v2/userinfo',
+                headers={'Authorization': f"Bearer {token['access_token']}"},
+                timeout=10
+            )
+            
+            if user_info_response.status_code != 200:
+                return redirect(f"{frontend_url}#/login?error=oauth_failed")
+            
+            user_info = user_info_response.json()
         
         # Extract user information
         google_id = user_info.get('id') or user_info.get('sub')
@@ -1634,21 +2140,13 @@ def google_callback():
                 oauth_id=google_id
             )
             
+            # A concurrent callback for the same Google ID gets the existing account back
             if not user:
-                print(f"Failed to create user. This might be because:")
-                print(f"  - Username '{name}' already exists")
-                print(f"  - Google ID '{google_id}' already exists")
-                print(f"  - Email '{email}' might conflict")
-                
-                # Check if OAuth ID already exists (user already created)
-                existing_oauth = get_user_by_oauth('google', google_id)
-                if existing_oauth:
-                    print(f"User already exists with this Google ID, using existing account")
-                    user = existing_oauth
-                else:
-                    return redirect(f"{frontend_url}#/login?error=user_creation_failed")
+                print(f"✗ Failed to create user for Google ID {google_id}")
+                return redirect(f"{frontend_url}#/login?error=user_creation_failed")
         
         # Set session (for web client)
+        invalidate_user(user['id'])
         session['user_id'] = user['id']
         session['username'] = user['username']
         
@@ -1658,8 +2156,6 @@ def google_callback():
         
         if is_local_client:
             # Generate a simple auth token (user_id + timestamp hash)
-            import hashlib
-            import time
             token_data = f"{user['id']}:{time.time()}"
             auth_token = hashlib.sha256(f"{token_data}:{app.secret_key}".encode()).hexdigest()[:32]
             
@@ -1680,7 +2176,6 @@ def google_callback():
         
     except Exception as e:
         print(f"Google OAuth error: {str(e)}")
-        import traceback
         traceback.print_exc()
         return redirect(f"{frontend_url}#/login?error=oauth_error")
 
@@ -1690,13 +2185,10 @@ def google_callback():
 # ======================
 
 @app.route("/api/shows", methods=["GET"])
+@auth_required
 def get_shows():
     """Get all shows for current user"""
-    auth_error = require_auth()
-    if auth_error:
-        return auth_error
-    
-    user_id = get_current_user_id()
+    user_id = g.user_id
     shows = get_user_shows(user_id)
     
     # Reconstruct video URLs from current server base URL to ensure correct environment
@@ -1717,141 +2209,164 @@ def get_shows():
 
 
 @app.route("/api/shows", methods=["POST"])
+@auth_required
 def save_show_endpoint():
     """Save a show"""
-    auth_error = require_auth()
-    if auth_error:
-        return auth_error
-    
     data = request.json
+    if not data or not isinstance(data, dict):
+        return jsonify({"error": "No data provided"}), 400
+    
+    # Bulk sync: {"shows": {name: data, ...}} saved in one statement
+    shows = data.get("shows")
+    if isinstance(shows, dict):
+        if not all(isinstance(name, str) and name.strip() for name in shows):
+            return jsonify({"error": "shows must map non-empty show names to show data"}), 400
+        save_shows_bulk(g.user_id, {name.strip(): show for name, show in shows.items()})
+        return jsonify({"success": True, "saved": len(shows)})
+    
     show_name = data.get("name", "").strip()
     show_data = data.get("data", {})
     
     if not show_name:
         return jsonify({"error": "Show name required"}), 400
     
-    user_id = get_current_user_id()
+    user_id = g.user_id
     save_show(user_id, show_name, show_data)
-    return jsonify({"success": True})
+    return ok_response()
 
 
 @app.route("/api/shows/<show_name>", methods=["DELETE"])
+@auth_required
 def delete_show_endpoint(show_name):
     """Delete a show"""
-    auth_error = require_auth()
-    if auth_error:
-        return auth_error
-    
-    user_id = get_current_user_id()
+    user_id = g.user_id
     deleted = delete_show(user_id, show_name)
     if deleted:
-        return jsonify({"success": True})
+        return ok_response()
     else:
         return jsonify({"error": "Show not found"}), 404
 
 
 @app.route("/api/library", methods=["GET"])
+@auth_required
 def get_library():
     """Get library metadata for current user"""
-    auth_error = require_auth()
-    if auth_error:
-        return auth_error
-    
-    user_id = get_current_user_id()
+    user_id = g.user_id
     library = get_user_library(user_id)
     return jsonify(library)
 
 
 @app.route("/api/library", methods=["POST"])
+@auth_required
 def save_library_endpoint():
     """Save library metadata"""
-    auth_error = require_auth()
-    if auth_error:
-        return auth_error
-    
     try:
         data = request.json
-        if not data:
+        if not data or not isinstance(data, dict):
             return jsonify({"error": "No data provided"}), 400
         
+        # Bulk sync: {"items": {filename: metadata, ...}} saved in one statement
+        items = data.get("items")
+        if isinstance(items, dict):
+            if not all(isinstance(f, str) and f and isinstance(m, dict) for f, m in items.items()):
+                return jsonify({"error": "items must map filenames to metadata objects"}), 400
+            user_id = g.user_id
+            missing = save_library_metadata_bulk(user_id, items)
+            # Unregistered videos go through the single-item path, which can
+            # register a file that exists locally
+            not_found = [
+                f for f in missing
+                if f not in items or save_library_metadata(user_id, f, items[f]) is None
+            ]
+            if app.debug:
+                print(f"Saved library metadata for {len(items) - len(not_found)}/{len(items)} video(s) for user {user_id}")
+            return jsonify({"success": True, "not_found": not_found})
+        
         filename = data.get("filename")
         metadata = data.get("metadata", {})
         
-        if not filename:
+        if not filename or not isinstance(filename, str):
             return jsonify({"error": "Filename required"}), 400
+        if not isinstance(metadata, dict):
+            return jsonify({"error": "metadata must be an object"}), 400
         
-        user_id = get_current_user_id()
-        print(f"Saving library metadata for user {user_id}, filename: {filename}")
-        print(f"Metadata keys: {list(metadata.keys())}")
+        user_id = g.user_id
+        if app.debug:
+            print(f"Saving library metadata for user {user_id}, filename: {filename}")
+            print(f"Metadata keys: {list(metadata.keys())}")
         
+        # Registers an unregistered local file itself; None means there is no such file
         result = save_library_metadata(user_id, filename, metadata)
         
         if result is None:
-            # Video doesn't exist in shared storage - try to create it
-            print(f"Video {filename} not found in shared storage, attempting to create entry...")
-            from pathlib import Path
-            videos_dir = Path(__file__).parent / "videos"
-            filepath = videos_dir / filename
-            
-            if filepath.exists():
-                print(f"File exists, creating video entry...")
-                file_size = filepath.stat().st_size
-                from database import create_video, add_video_to_library
-                video_id = create_video(filename, None, metadata.get("title", filename), file_size)
-                if video_id:
-                    add_video_to_library(user_id, video_id, metadata)
-                    print(f"Created video entry and added to library")
-                    return jsonify({"success": True})
-            else:
-                print(f"File {filename} does not exist in videos directory")
-                return jsonify({"error": f"Video file not found: {filename}"}), 404
+            print(f"File {filename} does not exist in videos directory")
+            return jsonify({"error": f"Video file not found: {filename}"}), 404
         
-        print(f"Successfully saved library metadata")
-        return jsonify({"success": True})
+        if app.debug:
+            print(f"Successfully saved library metadata")
+        return ok_response()
     except Exception as e:
         print(f"Error saving library metadata: {str(e)}")
-        import traceback
         traceback.print_exc()
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 
 @app.route("/api/library/<filename>", methods=["DELETE"])
+@auth_required
 def delete_library_endpoint(filename):
     """Delete library metadata"""
-    auth_error = require_auth()
-    if auth_error:
-        return auth_error
-    
-    user_id = get_current_user_id()
+    user_id = g.user_id
     deleted = delete_library_item(user_id, filename)
     if deleted:
-        return jsonify({"success": True})
+        return ok_response()
     else:
         return jsonify({"error": "Library item not found"}), 404
 
 
+def unlink_local_videos(filenames):
+    """Delete the given files from VIDEOS_DIR, returning the ones that existed"""
+    removed = []
+    if not filenames:
+        return removed
+    
+    # Unlink relative to an open directory fd where supported (not on Windows):
+    # no per-file path building, and no exists() check racing the unlink
+    if os.unlink in os.supports_dir_fd:
+        dir_fd = os.open(VIDEOS_DIR, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            for filename in filenames:
+                try:
+                    os.unlink(filename, dir_fd=dir_fd)
+                except FileNotFoundError:
+                    continue
+                removed.append(filename)
+        finally:
+            os.close(dir_fd)
+    else:
+        for filename in filenames:
+            try:
+                (VIDEOS_DIR / filename).unlink()
+            except FileNotFoundError:
+                continue
+            removed.append(filename)
+    return removed
+
+
 @app.route("/api/cleanup", methods=["POST"])
+@auth_required
 def cleanup_videos():
     """Clean up orphaned videos (videos with no library references)"""
-    auth_error = require_auth()
-    if auth_error:
-        return auth_error
-    
     deleted_files = cleanup_orphaned_videos()
     
     # Also delete the actual files from R2 and local storage
     files_deleted = []
-    for filename in deleted_files:
-        # Delete from R2 if enabled
-        if R2_ENABLED:
-            if delete_from_r2(filename):
-                files_deleted.append(f"{filename} (R2)")
-        
-        # Delete local file if it exists
-        filepath = VIDEOS_DIR / filename
-        if filepath.exists():
-            filepath.unlink()
-            files_deleted.append(filename)
+    # Delete from R2 in batches rather than one request per file
+    if R2_ENABLED:
+        release_request_db()
+        r2_deleted = delete_many_from_r2(deleted_files)
+        files_deleted.extend(f"{filename} (R2)" for filename in deleted_files if filename in r2_deleted)
+    
+    files_deleted.extend(unlink_local_videos(deleted_files))
     
     return jsonify({
         "success": True,
@@ -1861,22 +2376,18 @@ def cleanup_videos():
 
 
 @app.route("/api/debug/downloads", methods=["GET"])
+@auth_required
 def debug_downloads():
     """Debug endpoint to check recent downloads and their status"""
-    auth_error = require_auth()
-    if auth_error:
-        return auth_error
-    
-    user_id = get_current_user_id()
+    user_id = g.user_id
     
     # Get all downloads for this user
-    user_downloads = {
-        vid: info for vid, info in downloads.items()
-        if info.get("user_id") == user_id
-    }
+    with downloads_lock:
+        user_downloads = {
+            vid: asdict(downloads[vid]) for vid in downloads_by_user.get(user_id, ())
+        }
     
     # Get user's library
-    from database import get_user_library
     user_library = get_user_library(user_id)
     
     return jsonify({
@@ -1887,21 +2398,67 @@ def debug_downloads():
     })
 
 
-@app.route("/api/health")
-def health():
-    """Health check endpoint"""
+# Health checks are polled by the frontend and the load balancer - only re-run
+# `yt-dlp --version` every HEALTH_CACHE_TTL seconds and reuse the encoded body.
+# Once a body exists, refreshes happen on a background thread so no request waits
+# on the subprocess.
+HEALTH_CACHE_TTL = 300
+_health_cache = {'expires': 0.0, 'body': None}
+_health_refresh_lock = threading.Lock()
+
+
+def _refresh_health_body():
+    """Probe yt-dlp and store the encoded health response"""
     # Check if yt-dlp is available
     try:
-        result = subprocess.run(["yt-dlp", "--version"], capture_output=True, text=True)
+        result = subprocess.run([YTDLP_BIN, "--version"], capture_output=True, text=True, close_fds=False)
         ytdlp_version = result.stdout.strip() if result.returncode == 0 else None
     except FileNotFoundError:
         ytdlp_version = None
     
-    return jsonify({
-        "status": "ok",
-        "ytdlp_available": ytdlp_version is not None,
-        "ytdlp_version": ytdlp_version
-    })
+    with app.app_context():
+        body = jsonify({
+            "status": "ok",
+            "ytdlp_available": ytdlp_version is not None,
+            "ytdlp_version": ytdlp_version
+        }).get_data()
+    _health_cache['body'] = body
+    _health_cache['expires'] = time.monotonic() + HEALTH_CACHE_TTL
+
+
+def _refresh_health_in_background():
+    """Start a refresh unless one is already running"""
+    if not _health_refresh_lock.acquire(blocking=False):
+        return
+    
+    def run():
+        try:
+            _refresh_health_body()
+        except Exception as e:
+            print(f"⚠ Health check refresh failed: {e}")
+        finally:
+            _health_refresh_lock.release()
+    
+    threading.Thread(target=run, name='health-refresh', daemon=True).start()
+
+
+# Warm the cache at import so the first health check doesn't pay for the probe either
+_refresh_health_in_background()
+
+
+@app.route("/api/health")
+def health():
+    """Health check endpoint"""
+    if _health_cache['body'] is None:
+        # Startup probe hasn't finished yet - wait for it rather than probing twice
+        with _health_refresh_lock:
+            if _health_cache['body'] is None:
+                _refresh_health_body()
+    elif time.monotonic() >= _health_cache['expires']:
+        _refresh_health_in_background()
+    
+    # Fresh Response each time (after_request handlers add headers to it)
+    return Response(_health_cache['body'], mimetype='application/json')
 
 
 if __name__ == "__main__":
@@ -1918,7 +2475,8 @@ if __name__ == "__main__":
     
     if IS_PRODUCTION:
         print(f"🌐 Starting production server on port {port}")
+        print("⚠️  Werkzeug's server is not meant for production - run: gunicorn -c gunicorn.conf.py server:app")
     else:
         print(f"🌐 Starting development server on http://localhost:{port}")
     
-    app.run(host=host, port=port, debug=debug)
+    app.run(host=host, port=port, debug=debug, threaded=True)
@@ -0,0 +1,97 @@
+"""
+Short-lived cache of user records for authenticated requests.
+
+Entries live in Redis when a client is configured (shared by every worker),
+otherwise in a per-process dict. Either way they expire after USER_CACHE_TTL
+seconds and are dropped explicitly on login, logout and cookie changes.
+"""
+import json
+import threading
+import time
+
+from database import get_user_by_id, get_user_youtube_cookies
+
+USER_CACHE_TTL = 300
+
+_redis = None
+_local = {}
+_local_lock = threading.Lock()
+
+
+def init_user_cache(redis_client):
+    """Use the given Redis client for cache entries (None keeps the in-process dict)"""
+    global _redis
+    _redis = redis_client
+
+
+def _user_key(user_id):
+    return f"u:{user_id}"
+
+
+def _cookies_key(user_id):
+    return f"u:{user_id}:hasck"
+
+
+def _cache_get(key):
+    if _redis is not None:
+        try:
+            raw = _redis.get(key)
+            return json.loads(raw) if raw is not None else None
+        except Exception as e:
+            print(f"⚠ User cache read failed: {e}")
+            return None
+    with _local_lock:
+        entry = _local.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        _local.pop(key, None)
+    return None
+
+
+def _cache_set(key, value):
+    if _redis is not None:
+        try:
+            _redis.setex(key, USER_CACHE_TTL, json.dumps(value))
+        except Exception as e:
+            print(f"⚠ User cache write failed: {e}")
+        return
+    with _local_lock:
+        _local[key] = (time.monotonic() + USER_CACHE_TTL, value)
+
+
+def get_cached_user(user_id):
+    """get_user_by_id, served from the cache when possible"""
+    key = _user_key(user_id)
+    user = _cache_get(key)
+    if user is None:
+        user = get_user_by_id(user_id)
+        # Unknown users aren't cached so a later registration isn't masked
+        if user:
+            _cache_set(key, user)
+    return user
+
+
+def user_has_youtube_cookies(user_id):
+    """Whether the user has YouTube cookies saved, served from the cache when possible"""
+    key = _cookies_key(user_id)
+    has_cookies = _cache_get(key)
+    if has_cookies is None:
+        has_cookies = get_user_youtube_cookies(user_id) is not None
+        _cache_set(key, has_cookies)
+    return has_cookies
+
+
+def invalidate_user(user_id):
+    """Drop cached entries for a user"""
+    if not user_id:
+        return
+    keys = (_user_key(user_id), _cookies_key(user_id))
+    if _redis is not None:
+        try:
+            _redis.delete(*keys)
+        except Exception as e:
+            print(f"⚠ User cache invalidation failed: {e}")
+        return
+    with _local_lock:
+        for key in keys:
+            _local.pop(key, None)